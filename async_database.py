@@ -0,0 +1,226 @@
+"""
+Asyncio facade over Database for use inside an event loop.
+
+Every call is run on a single dedicated executor thread, so the event
+loop never blocks on SQLite.  Writes made by any number of coroutines
+during the same loop iteration are queued and applied together in one
+shared transaction, each inside its own savepoint so that a failing
+write does not undo the others.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Iterable
+
+from bill import Bill
+from database import (
+    Balances,
+    Database,
+    Payment,
+    PaymentResult,
+    UtilityStats,
+)
+
+Write = tuple[Callable, tuple, asyncio.Future]
+
+
+class AsyncDatabase:
+    """Awaitable equivalents of the Database methods."""
+
+    def __init__(self, db: Database, max_batch: int = 500) -> None:
+        """Wrap a Database and start its executor thread."""
+
+        self.db = db
+        self.max_batch = max_batch
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="database"
+        )
+        self._pending: list[Write] = []
+        self._flush_scheduled = False
+        self._flushes: set[asyncio.Future] = set()
+
+        # Number of writes applied and transactions used to apply them
+        self.writes = 0
+        self.transactions = 0
+
+    async def close(self) -> None:
+        """Wait for queued writes, then close the database."""
+
+        while self._pending or self._flushes:
+            if self._flushes:
+                await asyncio.wait(set(self._flushes))
+            else:
+                await asyncio.sleep(0)
+        await self._run(self.db.close)
+        self._executor.shutdown()
+
+    async def get_all_records(self) -> list[Bill]:
+        """Select all records in database."""
+
+        return await self._run(self.db.get_all_records)
+
+    async def get_record(self, bill: int | Bill) -> Any:
+        """Get a record, accepting either a bill id or a Bill object."""
+
+        return await self._run(self.db.get_record, bill)
+
+    async def get_utilities(self) -> list:
+        """Return a list of all utilities present in the database."""
+
+        return await self._run(self.db.get_utilities)
+
+    async def get_utility_stats(self) -> list[UtilityStats]:
+        """Return the bill count and unpaid total of every utility."""
+
+        return await self._run(self.db.get_utility_stats)
+
+    async def get_utility_record(self, utility: str) -> list[Bill]:
+        """Get a list of bills associated with a provided utility."""
+
+        return await self._run(self.db.get_utility_record, utility)
+
+    async def get_utility_page(self, utility: str, **kwargs) -> list[Bill]:
+        """Get one page of bills for a utility, using ids as the cursor."""
+
+        return await self._run(
+            partial(self.db.get_utility_page, utility, **kwargs)
+        )
+
+    async def get_unpaid_bills(self) -> list[Bill]:
+        """Get a list of all unpaid bills."""
+
+        return await self._run(self.db.get_unpaid_bills)
+
+    async def get_bills_owed(self, user: str) -> list[Bill]:
+        """Get a list of bills owed by a given user."""
+
+        return await self._run(self.db.get_bills_owed, user)
+
+    async def get_total_owed(self, user: str) -> float:
+        """Get a total of the amount owed by user 1 or user 2."""
+
+        return await self._run(self.db.get_total_owed, user)
+
+    async def get_balances(self) -> Balances:
+        """Get the totals owed by users 1 and 2."""
+
+        return await self._run(self.db.get_balances)
+
+    async def get_payments(self, **kwargs) -> list[Payment]:
+        """Get payments from the ledger, oldest first."""
+
+        return await self._run(partial(self.db.get_payments, **kwargs))
+
+    async def add_bill(self, bill: Bill) -> None:
+        """Queue a bill to be added to the database."""
+
+        return await self._enqueue(self.db.add_bill, bill)
+
+    async def add_bills(self, bills: Iterable[Bill], **kwargs) -> int:
+        """Queue many bills to be added together and return how many."""
+
+        return await self._enqueue(
+            partial(self.db.add_bills, list(bills), **kwargs)
+        )
+
+    async def pay_bills(
+        self, ids: Iterable[int], user: str, **kwargs
+    ) -> PaymentResult:
+        """Queue a payment of a user's portion of many bills."""
+
+        return await self._enqueue(
+            partial(self.db.pay_bills, list(ids), user, **kwargs)
+        )
+
+    async def remove_bill(self, bill: Any) -> None:
+        """Queue a bill to be removed from the database."""
+
+        return await self._enqueue(self.db.remove_bill, bill)
+
+    async def add_utility(self, utility: str) -> bool:
+        """Queue a utility to be added, unless it already exists."""
+
+        return await self._enqueue(self.db.add_utility, utility)
+
+    async def remove_utility(self, utility: str) -> None:
+        """Queue a utility and its bills to be removed."""
+
+        return await self._enqueue(self.db.remove_utility, utility)
+
+    async def _run(self, func: Callable, *args: Any) -> Any:
+        """Run a call on the executor thread and wait for its result."""
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _enqueue(self, func: Callable, *args: Any) -> asyncio.Future:
+        """Queue a write to be applied with the others of this iteration."""
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((func, args, future))
+
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            loop.call_soon(self._flush)
+        return future
+
+    def _flush(self) -> None:
+        """Send the queued writes to the executor in batches."""
+
+        self._flush_scheduled = False
+        pending, self._pending = self._pending, []
+        loop = asyncio.get_running_loop()
+
+        for start in range(0, len(pending), self.max_batch):
+            batch = pending[start : start + self.max_batch]
+            flush = loop.run_in_executor(self._executor, self._apply, batch)
+            self._flushes.add(flush)
+            flush.add_done_callback(partial(self._deliver, batch))
+
+    def _apply(self, batch: list[Write]) -> list[tuple[bool, Any]]:
+        """Apply a batch of writes in one transaction on the executor.
+
+        Each write runs in its own savepoint, so one which fails is undone
+        without the others.  Returns whether each write succeeded, with
+        its result or error.
+        """
+
+        outcomes = []
+        with self.db.transaction() as c:
+            if not self.db.conn.in_transaction:
+                c.execute("BEGIN")
+
+            for func, args, future in batch:
+                try:
+                    with self.db.savepoint():
+                        result = func(*args)
+                except Exception as error:
+                    outcomes.append((False, error))
+                else:
+                    outcomes.append((True, result))
+
+        self.writes += len(batch)
+        self.transactions += 1
+        return outcomes
+
+    def _deliver(self, batch: list[Write], flush: asyncio.Future) -> None:
+        """Hand each queued write its result once its batch is done."""
+
+        self._flushes.discard(flush)
+        error = flush.exception()
+        outcomes = flush.result() if error is None else []
+
+        for index, (_, _, future) in enumerate(batch):
+            if future.cancelled():
+                continue
+            if error is not None:
+                future.set_exception(error)
+                continue
+
+            succeeded, value = outcomes[index]
+            if succeeded:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
@@ -0,0 +1,241 @@
+"""
+Online backups of records.db using SQLite's backup API.
+
+A snapshot of the live database is taken a few pages at a time,
+so readers and writers are only locked out for one step at a time.
+Each backup is recorded in a manifest next to the backup file holding
+a checksum of every page and of the whole file.  Incremental backups
+compare a fresh snapshot against the manifest and only rewrite the pages
+which have changed, and restores refuse to run if the backup file
+no longer matches its manifest.  New backups are written beside the
+previous one and only replace it once complete, so an interrupted
+backup leaves the previous one usable.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+from hashlib import sha256
+from typing import Callable, NamedTuple, Optional
+
+PAGES_PER_STEP = 256
+BACKUP_NAME = "records.db"
+MANIFEST_SUFFIX = ".manifest.json"
+
+Progress = Callable[[int, int, int], object]
+
+
+class BackupResult(NamedTuple):
+    """Store a summary of a completed backup."""
+
+    path: str
+    pages_total: int
+    pages_written: int
+
+
+class BackupError(Exception):
+    """Raised when a backup cannot be verified."""
+
+
+def print_progress(status: int, remaining: int, total: int) -> None:
+    """Report the progress of a backup step on the terminal."""
+
+    if total:
+        print(f"Copied {total - remaining} of {total} pages...")
+
+
+def snapshot(
+    source: str,
+    destination: str,
+    progress: Optional[Progress] = None,
+) -> None:
+    """Copy a consistent snapshot of source into destination."""
+
+    source_conn = sqlite3.connect(source)
+    destination_conn = sqlite3.connect(destination)
+    try:
+        source_conn.backup(
+            destination_conn, pages=PAGES_PER_STEP, progress=progress
+        )
+    finally:
+        destination_conn.close()
+        source_conn.close()
+
+
+def page_hashes(path: str, page_size: int) -> list[str]:
+    """Return the checksum of every page in a database file."""
+
+    hashes = []
+    with open(path, "rb") as file:
+        while page := file.read(page_size):
+            hashes.append(sha256(page).hexdigest())
+    return hashes
+
+
+def file_hash(path: str) -> str:
+    """Return the checksum of a whole file."""
+
+    digest = sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(backup_path: str) -> Optional[dict]:
+    """Return the manifest recorded for a backup file, if there is one."""
+
+    try:
+        with open(backup_path + MANIFEST_SUFFIX) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(backup_path: str, page_size: int) -> None:
+    """Record the page and file checksums of a backup file."""
+
+    manifest = {
+        "page_size": page_size,
+        "pages": page_hashes(backup_path, page_size),
+        "sha256": file_hash(backup_path),
+    }
+    with open(backup_path + MANIFEST_SUFFIX, "w") as file:
+        json.dump(manifest, file)
+
+
+def verify(backup_path: str) -> dict:
+    """Check a backup file against its manifest and return the manifest."""
+
+    manifest = read_manifest(backup_path)
+    if manifest is None:
+        raise BackupError(f"No manifest found for {backup_path}.")
+    if file_hash(backup_path) != manifest["sha256"]:
+        raise BackupError(f"{backup_path} does not match its manifest.")
+    return manifest
+
+
+def backup(
+    source: str,
+    destination_dir: str,
+    incremental: bool = False,
+    progress: Optional[Progress] = None,
+) -> BackupResult:
+    """Back up the database at source into destination_dir.
+
+    An incremental backup only rewrites the pages of the existing backup
+    which differ from the current database.  It falls back to a full
+    backup when there is no verifiable previous backup.
+    """
+
+    backup_path = _backup_path(destination_dir, source)
+
+    if incremental:
+        try:
+            manifest = verify(backup_path)
+        except (BackupError, FileNotFoundError):
+            incremental = False
+
+    # The new backup is staged next to the old one and swapped in at the end
+    handle, staging_path = tempfile.mkstemp(suffix=".db", dir=destination_dir)
+    os.close(handle)
+    try:
+        if not incremental:
+            snapshot(source, staging_path, progress)
+            pages_total = _install(staging_path, backup_path)
+            return BackupResult(backup_path, pages_total, pages_total)
+
+        # Take the snapshot locally, then ship only the changed pages.
+        handle, snapshot_path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        try:
+            snapshot(source, snapshot_path, progress)
+            page_size = _page_size(snapshot_path)
+            if page_size != manifest["page_size"]:
+                shutil.copyfile(snapshot_path, staging_path)
+                pages_total = _install(staging_path, backup_path)
+                return BackupResult(backup_path, pages_total, pages_total)
+
+            shutil.copyfile(backup_path, staging_path)
+            old_pages = manifest["pages"]
+            pages_written = 0
+            pages_total = 0
+            with open(snapshot_path, "rb") as new, open(
+                staging_path, "r+b"
+            ) as old:
+                while page := new.read(page_size):
+                    if (
+                        pages_total >= len(old_pages)
+                        or sha256(page).hexdigest() != old_pages[pages_total]
+                    ):
+                        old.seek(pages_total * page_size)
+                        old.write(page)
+                        pages_written += 1
+                    pages_total += 1
+                old.truncate(pages_total * page_size)
+        finally:
+            os.remove(snapshot_path)
+
+        _install(staging_path, backup_path)
+        return BackupResult(backup_path, pages_total, pages_written)
+    finally:
+        for path in (staging_path, staging_path + MANIFEST_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def restore(
+    backup_dir: str,
+    destination: str,
+    progress: Optional[Progress] = None,
+) -> None:
+    """Verify the backup in backup_dir and restore it into destination."""
+
+    backup_path = _backup_path(backup_dir, destination)
+    verify(backup_path)
+    snapshot(backup_path, destination, progress)
+
+
+def _backup_path(directory: str, database: str) -> str:
+    """Return the backup file in directory, which must not be database."""
+
+    if not directory:
+        raise BackupError("No backup directory has been set.")
+    backup_path = os.path.join(directory, BACKUP_NAME)
+    if (
+        os.path.exists(backup_path)
+        and os.path.exists(database)
+        and os.path.samefile(backup_path, database)
+    ):
+        raise BackupError(f"{backup_path} is the database itself.")
+    return backup_path
+
+
+def _install(staging_path: str, backup_path: str) -> int:
+    """Replace a backup with a staged copy and return its page count.
+
+    The staged file and its manifest are flushed to disk before they
+    replace the backup and then its manifest.
+    """
+
+    page_size = _page_size(staging_path)
+    write_manifest(staging_path, page_size)
+    for path in (staging_path, staging_path + MANIFEST_SUFFIX):
+        with open(path, "rb") as file:
+            os.fsync(file.fileno())
+
+    os.replace(staging_path, backup_path)
+    os.replace(staging_path + MANIFEST_SUFFIX, backup_path + MANIFEST_SUFFIX)
+    return len(read_manifest(backup_path)["pages"])
+
+
+def _page_size(path: str) -> int:
+    """Return the page size of a database file."""
+
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        conn.close()
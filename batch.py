@@ -0,0 +1,144 @@
+"""
+Non-interactive command mode for scripting bill entry.
+
+Commands are read one per line from a file or standard input:
+
+    add UTILITY DATE AMOUNT [NOTE...]
+    pay BILL_ID [BILL_ID...] USER
+    remove BILL_ID
+    remove-utility UTILITY
+
+Arguments are split like a shell command line, so names and notes
+containing spaces can be quoted.  Blank lines and lines starting with
+'#' are ignored.  Every command runs in one transaction without any
+menus being rendered, and an invalid command rolls the whole batch back.
+"""
+
+import shlex
+from collections import Counter
+from time import perf_counter
+from typing import Iterable, NamedTuple
+
+from bill import Bill
+from database import Database
+
+USAGE = {
+    "add": "add UTILITY DATE AMOUNT [NOTE...]",
+    "pay": "pay BILL_ID [BILL_ID...] USER",
+    "remove": "remove BILL_ID",
+    "remove-utility": "remove-utility UTILITY",
+}
+
+
+class BatchResult(NamedTuple):
+    """Store a summary of a completed batch."""
+
+    commands: Counter
+    elapsed: float
+
+
+class BatchError(Exception):
+    """Raised when a command in a batch cannot be run."""
+
+    def __init__(self, line_number: int, line: str, message: str) -> None:
+        super().__init__(f"Line {line_number}: {message}\n  {line.strip()}")
+
+
+def parse_bill_id(value: str) -> int:
+    """Read a bill id argument."""
+
+    if not value.isdigit():
+        raise ValueError(f"{value!r} is not a bill ID.")
+    return int(value)
+
+
+def run_batch(db: Database, lines: Iterable[str]) -> BatchResult:
+    """Run every command in lines in a single transaction.
+
+    Consecutive add commands are inserted together with add_bills.
+    Raises BatchError, leaving the database untouched, if any command
+    is malformed or refers to a bill or user which does not exist.
+    """
+
+    users = {name.lower() for name in db.get_users().values()}
+    commands: Counter = Counter()
+    pending: list[Bill] = []
+    start = perf_counter()
+
+    with db.transaction():
+        for line_number, line in enumerate(lines, 1):
+            try:
+                args = shlex.split(line, comments=True)
+                if not args:
+                    continue
+
+                command, args = args[0].lower(), args[1:]
+                if command not in USAGE:
+                    raise ValueError(f"Unknown command {command!r}.")
+
+                if command == "add":
+                    if len(args) < 3 or not args[2].isdigit():
+                        raise ValueError(f"Usage: {USAGE[command]}")
+                    utility, date, amount, *note = args
+                    pending.append(
+                        Bill(
+                            utility.lower(),
+                            date,
+                            int(amount),
+                            note=" ".join(note),
+                        )
+                    )
+                    commands[command] += 1
+                    continue
+
+                # Keep adds in order with the commands which follow them
+                db.add_bills(pending)
+                pending.clear()
+
+                if command == "pay":
+                    if len(args) < 2:
+                        raise ValueError(f"Usage: {USAGE[command]}")
+                    if args[-1].lower() not in users:
+                        raise ValueError(f"No user named {args[-1]!r}.")
+                    ids = [parse_bill_id(arg) for arg in args[:-1]]
+                    missing = db.pay_bills(ids, args[-1].lower()).missing
+                    if missing:
+                        raise ValueError(f"No bills with IDs {missing}.")
+
+                elif command == "remove":
+                    if len(args) != 1:
+                        raise ValueError(f"Usage: {USAGE[command]}")
+                    bill_id = parse_bill_id(args[0])
+                    if db.get_record(bill_id) is None:
+                        raise ValueError(f"No bill with ID {bill_id}.")
+                    db.remove_bill(bill_id)
+
+                else:
+                    if len(args) != 1:
+                        raise ValueError(f"Usage: {USAGE[command]}")
+                    db.remove_utility(args[0].lower())
+
+                commands[command] += 1
+
+            except ValueError as error:
+                raise BatchError(line_number, line, str(error)) from error
+
+        db.add_bills(pending)
+
+    return BatchResult(commands, perf_counter() - start)
+
+
+def format_result(result: BatchResult) -> str:
+    """Summarize a completed batch for printing to the terminal."""
+
+    total = sum(result.commands.values())
+    counts = ", ".join(
+        f"{result.commands[command]} {command}"
+        for command in USAGE
+        if result.commands[command]
+    )
+    rate = total / result.elapsed if result.elapsed else 0
+    return (
+        f"Ran {total} commands ({counts or 'none'}) "
+        f"in {result.elapsed:.3f} seconds ({rate:.0f} commands/sec)."
+    )
@@ -0,0 +1,297 @@
+"""
+Benchmarks for the reporting and database code paths.
+
+Run "python benchmarks.py [SIZES...]" to time the Database hot paths
+against generated debugging databases of each size (1000, 10000 and
+100000 bills by default, spread over UTILITIES utilities).
+
+    --output FILE      write the results as JSON
+    --baseline FILE    compare against earlier JSON results and exit
+                       with status 1 if any timing regressed
+    --threshold RATIO  slowdown counted as a regression (1.25 by default);
+                       slowdowns of less than NOISE_FLOOR seconds
+                       are never counted
+    --reports          time the vectorized reports against the same
+                       totals computed with a Python loop over Bill objects
+    --settle USERS     time settlement plans for USERS participants
+                       sharing bills of each size
+"""
+
+import json
+import platform
+import sqlite3
+import sys
+from random import choice, randint, sample
+from statistics import median
+from time import perf_counter
+from typing import Callable
+
+from database import Database
+from fixtures import generate_bill, seeded_database, utility_names
+from helpers import flag_argument
+from splitting import (
+    EXACT_LIMIT,
+    Share,
+    net_balances,
+    settle,
+    settle_exactly,
+)
+
+UTILITIES = 50
+THRESHOLD = 1.25
+NOISE_FLOOR = 0.0005
+
+
+def timed(
+    func: Callable, repeat: int = 5, setup: Callable | None = None
+) -> float:
+    """Return the median of several timings of func in seconds.
+
+    setup is called before each timing without being timed.
+    """
+
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+    return median(timings)
+
+
+def bench_database(size: int, utilities: int = UTILITIES) -> dict:
+    """Time each Database hot path against size bills in seconds."""
+
+    db = seeded_database(size, utilities)
+    per_utility = size // utilities
+    user = db.get_user(1).lower()
+    utility = utility_names(utilities)[0]
+
+    unpaid: list[int] = []
+
+    def find_unpaid_bill() -> None:
+        db.add_bill(generate_bill(utility=utility, user1_paid=False))
+        unpaid[:] = [db.get_utility_page(utility, owed_by=user, limit=1)[0].id]
+
+    def add_removable_utility() -> None:
+        db.add_bills(
+            generate_bill(utility="removable") for _ in range(per_utility)
+        )
+
+    results = {
+        "get_all_records": timed(db.get_all_records),
+        "get_total_owed": timed(lambda: db.get_total_owed(user), 10),
+        # A bill is added before each cold timing so that the cached
+        # net balances are out of date and have to be worked out again
+        "get_net_balances": timed(
+            db.get_net_balances, setup=lambda: db.add_bill(generate_bill())
+        ),
+        "get_net_balances_cached": timed(db.get_net_balances, 10),
+        "get_utility_record": timed(lambda: db.get_utility_record(utility)),
+        "add_bill": timed(lambda: db.add_bill(generate_bill()), 10),
+        "pay_bills": timed(
+            lambda: db.pay_bills(unpaid, user), 10, setup=find_unpaid_bill
+        ),
+        "remove_utility": timed(
+            lambda: db.remove_utility("removable"),
+            setup=add_removable_utility,
+        ),
+    }
+    db.close()
+    return results
+
+
+def run_suite(sizes: list[int], utilities: int = UTILITIES) -> dict:
+    """Benchmark every size and return the results with their context."""
+
+    return {
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "utilities": utilities,
+        "results": {
+            str(size): bench_database(size, utilities) for size in sizes
+        },
+    }
+
+
+def find_regressions(
+    results: dict,
+    baseline: dict,
+    threshold: float = THRESHOLD,
+    floor: float = NOISE_FLOOR,
+) -> list[tuple[str, str, float]]:
+    """Compare results with a baseline run of the suite.
+
+    Returns the size, benchmark and slowdown of every timing
+    more than threshold times slower than in the baseline.
+    Slowdowns of floor seconds or less are left out, since timings
+    that short are mostly noise.  Timings missing from either run
+    are not compared.
+    """
+
+    regressions = []
+    for size, timings in results["results"].items():
+        baseline_timings = baseline["results"].get(size, {})
+        for name, seconds in timings.items():
+            before = baseline_timings.get(name)
+            if (
+                before
+                and seconds / before > threshold
+                and seconds - before > floor
+            ):
+                regressions.append((size, name, seconds / before))
+    return regressions
+
+
+def format_results(results: dict) -> str:
+    """Lay out suite results for printing to the terminal."""
+
+    lines = []
+    for size, timings in results["results"].items():
+        lines.append(f"{size} bills:")
+        for name, seconds in timings.items():
+            lines.append(f"  {name}: {seconds * 1000:.3f} ms")
+    return "\n".join(lines)
+
+
+def per_row_report(db: Database) -> tuple:
+    """Compute report totals by looping over every Bill object."""
+
+    records = db.get_all_records()
+    utilities: dict[str, list[int]] = {}
+    user1_owed = 0.0
+    user2_owed = 0.0
+    running = 0.0
+    for bill in records:
+        totals = utilities.setdefault(bill.utility, [0, 0])
+        totals[0] += bill.amount
+        if not bill.paid:
+            totals[1] += bill.amount
+        if not bill.user1_paid:
+            user1_owed += bill.owed_amount(1)
+            running += bill.owed_amount(1)
+        if not bill.user2_paid:
+            user2_owed += bill.owed_amount(2)
+            running -= bill.owed_amount(2)
+    return utilities, user1_owed, user2_owed, running
+
+
+def generate_shares(
+    users: int, size: int
+) -> list[tuple[int, list[Share]]]:
+    """Generate size bills shared by two to six of users participants."""
+
+    bills = []
+    for _ in range(size):
+        participants = sample(range(users), randint(2, min(6, users)))
+        bills.append(
+            (
+                randint(2000, 10000),
+                [
+                    Share(user, randint(1, 3), choice((True, False)))
+                    for user in participants
+                ],
+            )
+        )
+    return bills
+
+
+def bench_settlement(users: int, sizes: list[int]) -> None:
+    """Print timings of settlement plans for each number of bills.
+
+    Exact plans are compared with greedy ones on groups small enough
+    to be planned exactly.
+    """
+
+    for size in sizes:
+        bills = generate_shares(users, size)
+        balance_time = timed(lambda: net_balances(bills))
+        balances = net_balances(bills)
+        settle_time = timed(lambda: settle(balances))
+        print(
+            f"{users} users, {size} bills: balances {balance_time:.3f} s, "
+            f"greedy plan {settle_time * 1000:.1f} ms "
+            f"({len(settle(balances))} transfers)"
+        )
+
+    greedy_transfers = exact_transfers = 0
+    exact_time = 0.0
+    for _ in range(10):
+        balances = net_balances(generate_shares(EXACT_LIMIT, 50))
+        greedy_transfers += len(settle(balances))
+        start = perf_counter()
+        exact_transfers += len(settle_exactly(balances))
+        exact_time += perf_counter() - start
+    print(
+        f"{EXACT_LIMIT} users: exact plan {exact_time * 100:.1f} ms each, "
+        f"{exact_transfers / 10:.1f} transfers against "
+        f"{greedy_transfers / 10:.1f} greedy"
+    )
+
+
+def bench_reports(sizes: list[int]) -> None:
+    """Print timings of per-row and vectorized reports for each size.
+
+    The vectorized timing is split into loading the BillBatch
+    and computing the report from it.
+    """
+
+    import reports
+
+    for size in sizes:
+        db = seeded_database(size)
+        per_row = timed(lambda: per_row_report(db))
+        load = timed(db.get_bill_batch)
+        batch = db.get_bill_batch()
+        compute = timed(lambda: reports.build_report(batch))
+        db.close()
+
+        print(
+            f"{size} bills: per-row {per_row * 1000:.1f} ms, "
+            f"vectorized {(load + compute) * 1000:.1f} ms "
+            f"(load {load * 1000:.1f} ms, compute {compute * 1000:.1f} ms, "
+            f"{per_row / (load + compute):.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    flags = ("--output", "--baseline", "--threshold", "--settle")
+    sizes = [
+        int(arg)
+        for previous, arg in zip(sys.argv, sys.argv[1:])
+        if arg.isdigit() and previous not in flags
+    ] or [1000, 10000, 100000]
+
+    if "--reports" in sys.argv:
+        bench_reports(sizes)
+        sys.exit()
+
+    if "--settle" in sys.argv:
+        bench_settlement(int(flag_argument("--settle") or 1000), sizes)
+        sys.exit()
+
+    results = run_suite(sizes)
+    print(format_results(results))
+
+    output = flag_argument("--output")
+    if output:
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {output}.")
+
+    baseline_path = flag_argument("--baseline")
+    if baseline_path:
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+        threshold = float(flag_argument("--threshold") or THRESHOLD)
+
+        regressions = find_regressions(results, baseline, threshold)
+        for size, name, slowdown in regressions:
+            print(
+                f"REGRESSION: {name} at {size} bills "
+                f"is {slowdown:.2f}x slower"
+            )
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {baseline_path}.")
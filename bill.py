@@ -1,6 +1,45 @@
+from array import array
+from typing import Iterable, Iterator
+
+
+def parse_periods(date: str) -> list[int]:
+    """Return the months a bill date covers as YYYYMM integers.
+
+    Dates are written as 'MM-YY', with several months separated by commas,
+    for example '03-17,04-17'.  Parts in any other form are skipped.
+    """
+
+    periods = []
+    for part in date.split(","):
+        month, _, year = part.strip().partition("-")
+        if (
+            month.isdigit()
+            and year.isdigit()
+            and len(year) == 2
+            and 1 <= int(month) <= 12
+        ):
+            periods.append((2000 + int(year)) * 100 + int(month))
+    return periods
+
+
 class Bill:
     """Class which stores information about a single database record."""
 
+    __slots__ = (
+        "utility",
+        "amount",
+        "date",
+        "user1_paid",
+        "user2_paid",
+        "paid",
+        "note",
+        "id",
+        "user1",
+        "user2",
+        "user1_share",
+        "user2_share",
+    )
+
     def __init__(
         self,
         utility: str,
@@ -11,13 +50,18 @@ class Bill:
         paid: bool = False,
         note: str = "",
         primary_key: int = 1,
+        user1_share: float = 0.5,
+        user2_share: float = 0.5,
         **kwargs,
     ) -> None:
-        """Create a bill object with the given values."""
+        """Create a bill object with the given values.
+
+        user1_share and user2_share are the fractions of the amount which
+        fall to users 1 and 2, an even split unless the bill has shares.
+        """
 
         self.utility = utility
         self.amount = amount
-        self.owed_amount = int(amount) / 2
         self.date = date
 
         match user2_paid:
@@ -42,11 +86,22 @@ class Bill:
             case 0:
                 self.paid = False
             case _:
-                self.paid = paid   
+                self.paid = paid
 
         self.note = note
         self.id = primary_key
-        self.kwargs = kwargs
+        self.user1_share = user1_share
+        self.user2_share = user2_share
+
+        # User names are only kept for display and default to placeholders
+        self.user1 = kwargs.get("user1") or "User1"
+        self.user2 = kwargs.get("user2") or "User2"
+
+    def owed_amount(self, user: int) -> float:
+        """Amount of the bill which falls to user 1 or user 2."""
+
+        share = self.user1_share if user == 1 else self.user2_share
+        return int(self.amount) * share
 
     def __repr__(self) -> str:
         return (
@@ -62,24 +117,22 @@ class Bill:
         )
 
     def __str__(self) -> str:
-        if self.user1_paid is True:
+        if self.user1_share == 0:
+            user1_var = "no share"
+        elif self.user1_paid is True:
             user1_var = "paid"
         else:
             user1_var = "not paid yet"
 
-        if self.user2_paid is True:
+        if self.user2_share == 0:
+            user2_var = "no share"
+        elif self.user2_paid is True:
             user2_var = "paid"
         else:
             user2_var = "not paid yet"
 
-        if self.kwargs.get("user1"):
-            user1 = self.kwargs.get("user1")
-        else:
-            user1 = "User1"
-        if self.kwargs.get("user2"):
-            user2 = self.kwargs.get("user2")
-        else:
-            user2 = "User2"
+        user1 = self.user1
+        user2 = self.user2
 
         return f"""
 Date: {self.date} A {self.utility} bill for {self.amount} yen.
@@ -87,3 +140,146 @@ ID: {self.id}       {user1} has {user1_var} and {user2} has {user2_var}.
 
 Notes: {self.note}
             """
+
+
+class BillBatch:
+    """Columnar container for many bills without one object per bill.
+
+    Ids, amounts, payment flags and the shares of users 1 and 2
+    are kept in parallel arrays.
+    Utilities and dates repeat heavily, so each distinct value is stored
+    once and every bill holds an index into that list.
+    Notes are not kept.
+    """
+
+    __slots__ = (
+        "ids",
+        "amounts",
+        "user1_paid",
+        "user2_paid",
+        "paid",
+        "user1_share",
+        "user2_share",
+        "utility_codes",
+        "utilities",
+        "date_codes",
+        "dates",
+        "_utility_index",
+        "_date_index",
+    )
+
+    def __init__(self) -> None:
+        """Create an empty batch."""
+
+        self.ids = array("q")
+        self.amounts = array("q")
+        self.user1_paid = array("B")
+        self.user2_paid = array("B")
+        self.paid = array("B")
+        self.user1_share = array("d")
+        self.user2_share = array("d")
+        self.utility_codes = array("I")
+        self.utilities: list[str] = []
+        self.date_codes = array("I")
+        self.dates: list[str] = []
+        self._utility_index: dict[str, int] = {}
+        self._date_index: dict[str, int] = {}
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> "BillBatch":
+        """Build a batch from (id, utility, date, amount, user1_paid,
+        user2_paid, paid, user1_share, user2_share) rows."""
+
+        batch = cls()
+        batch.extend(rows)
+        return batch
+
+    def append(
+        self,
+        primary_key: int,
+        utility: str,
+        date: str,
+        amount: int,
+        user1_paid: bool,
+        user2_paid: bool,
+        paid: bool,
+        user1_share: float = 0.5,
+        user2_share: float = 0.5,
+    ) -> None:
+        """Add a single bill to the end of the batch."""
+
+        self.ids.append(primary_key)
+        self.amounts.append(int(amount))
+        self.user1_paid.append(bool(user1_paid))
+        self.user2_paid.append(bool(user2_paid))
+        self.paid.append(bool(paid))
+        self.user1_share.append(user1_share)
+        self.user2_share.append(user2_share)
+        self.utility_codes.append(
+            self._code(utility, self.utilities, self._utility_index)
+        )
+        self.date_codes.append(self._code(date, self.dates, self._date_index))
+
+    def extend(self, rows: Iterable[tuple]) -> None:
+        """Add many bills to the end of the batch, one column at a time."""
+
+        rows = list(rows)
+        if not rows:
+            return
+
+        (
+            ids,
+            utilities,
+            dates,
+            amounts,
+            user1_paid,
+            user2_paid,
+            paid,
+            user1_share,
+            user2_share,
+        ) = zip(*rows)
+        self.ids.extend(ids)
+        self.amounts.extend(map(int, amounts))
+        self.user1_paid.extend(map(bool, user1_paid))
+        self.user2_paid.extend(map(bool, user2_paid))
+        self.paid.extend(map(bool, paid))
+        self.user1_share.extend(user1_share)
+        self.user2_share.extend(user2_share)
+        self.utility_codes.extend(
+            self._code(utility, self.utilities, self._utility_index)
+            for utility in utilities
+        )
+        self.date_codes.extend(
+            self._code(date, self.dates, self._date_index) for date in dates
+        )
+
+    def bill(self, index: int) -> Bill:
+        """Build a Bill object for the bill at index."""
+
+        return Bill(
+            self.utilities[self.utility_codes[index]],
+            self.dates[self.date_codes[index]],
+            self.amounts[index],
+            user1_paid=bool(self.user1_paid[index]),
+            user2_paid=bool(self.user2_paid[index]),
+            paid=bool(self.paid[index]),
+            primary_key=self.ids[index],
+            user1_share=self.user1_share[index],
+            user2_share=self.user2_share[index],
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[Bill]:
+        return (self.bill(index) for index in range(len(self)))
+
+    @staticmethod
+    def _code(value: str, values: list[str], index: dict[str, int]) -> int:
+        """Return the code of value, adding it to values if it is new."""
+
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(values)
+            values.append(value)
+        return code
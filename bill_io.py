@@ -0,0 +1,91 @@
+"""
+Reading and writing bills as files for bulk import and export.
+
+Two formats are supported, chosen by file extension:
+".csv" files with a header row naming the bill columns,
+and ".jsonl" files with one JSON object per line.
+Rows are handled one at a time so files of any size can be streamed.
+"""
+
+import json
+from csv import DictReader, writer
+from typing import Any, Iterable, Iterator
+
+from bill import Bill
+
+BILL_COLUMNS = (
+    "utility",
+    "date",
+    "amount",
+    "user1_paid",
+    "user2_paid",
+    "paid",
+    "note",
+)
+
+
+def to_bool(value: Any) -> bool:
+    """Interpret a boolean written as a bool, a number or a string."""
+
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def row_to_bill(row: dict) -> Bill:
+    """Build a Bill from a mapping of column names to values."""
+
+    return Bill(
+        row["utility"],
+        row["date"],
+        int(row["amount"]),
+        user1_paid=to_bool(row.get("user1_paid", False)),
+        user2_paid=to_bool(row.get("user2_paid", False)),
+        paid=to_bool(row.get("paid", False)),
+        note=row.get("note") or "",
+    )
+
+
+def read_bills(path: str) -> Iterator[Bill]:
+    """Yield bills from a CSV or JSON Lines file."""
+
+    if path.endswith(".jsonl"):
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    yield row_to_bill(json.loads(line))
+
+    elif path.endswith(".csv"):
+        with open(path, newline="") as file:
+            for row in DictReader(file):
+                yield row_to_bill(row)
+
+    else:
+        raise ValueError(f"Unsupported file format: {path}")
+
+
+def write_bills(rows: Iterable[tuple], path: str) -> int:
+    """Write rows of BILL_COLUMNS values to a file and return the count."""
+
+    count = 0
+    if path.endswith(".jsonl"):
+        with open(path, "w") as file:
+            for row in rows:
+                record = dict(zip(BILL_COLUMNS, row))
+                for column in ("user1_paid", "user2_paid", "paid"):
+                    record[column] = bool(record[column])
+                file.write(json.dumps(record) + "\n")
+                count += 1
+
+    elif path.endswith(".csv"):
+        with open(path, "w", newline="") as file:
+            csv_writer = writer(file)
+            csv_writer.writerow(BILL_COLUMNS)
+            for row in rows:
+                csv_writer.writerow(row)
+                count += 1
+
+    else:
+        raise ValueError(f"Unsupported file format: {path}")
+
+    return count
@@ -1,7 +1,74 @@
+import queue
 import sqlite3
-from typing import Any, NamedTuple, TYPE_CHECKING
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import copy
+from datetime import datetime
+from itertools import islice
+from typing import (
+    Any,
+    Callable,
+    Hashable,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    TYPE_CHECKING,
+)
 
-from bill import Bill
+from bill import Bill, BillBatch, parse_periods
+from migrations import (
+    REBUILD_BALANCES,
+    REBUILD_UTILITIES,
+    migrate,
+)
+from splitting import Share, Transfer, net_balances, plan_settlement
+
+
+PAGE_SIZE = 10
+
+# Events passed to subscribers along with the name of a utility
+UTILITY_ADDED = "utility added"
+UTILITY_REMOVED = "utility removed"
+
+Subscriber = Callable[[str, str], Any]
+
+# Columns are always listed, since NamedRecord depends on their order
+SELECT_BILLS = """
+    SELECT id, utility, date, amount, user1_paid, user2_paid, paid, note,
+    user1_share, user2_share
+    FROM bills"""
+
+INSERT_BILL = """
+    INSERT INTO bills
+    (utility, date, amount, user1_paid, user2_paid, paid, note, utility_id)
+    VALUES
+    (:utility, :date, :amount, :user1_paid, :user2_paid, :paid, :note,
+    (SELECT id FROM utilities WHERE name = :utility))
+    """
+
+INSERT_UTILITY = "INSERT OR IGNORE INTO utilities (name) VALUES (?)"
+
+# Matches the bills of the utility named :utility using bills_utility_id
+UTILITY_BILLS = (
+    "utility_id = (SELECT id FROM utilities WHERE name = :utility)"
+)
+
+PAY_SHARE = """
+    UPDATE bill_shares SET paid = 1
+    WHERE bill_id = :bill_id AND user_id = :user_id AND paid = 0
+    """
+
+INSERT_PAYMENT = """
+    INSERT INTO payments (bill_id, user_id, amount, paid_at)
+    SELECT :bill_id, :user_id, bills.amount * share.weight / (
+        SELECT SUM(weight) FROM bill_shares WHERE bill_id = :bill_id
+    ), :paid_at
+    FROM bills
+    JOIN bill_shares AS share
+    ON share.bill_id = bills.id AND share.user_id = :user_id
+    WHERE bills.id = :bill_id
+    """
 
 
 class NamedRecord(NamedTuple):
@@ -15,34 +82,414 @@ class NamedRecord(NamedTuple):
     user2_paid: bool
     paid: bool
     note: str
+    user1_share: float
+    user2_share: float
+
+
+class Payment(NamedTuple):
+    """Store a single payment from the payments ledger."""
+
+    id: int
+    bill_id: int
+    user: str
+    amount: float
+    paid_at: str
+
+
+class PaymentResult(NamedTuple):
+    """Store the outcome of paying a user's shares of several bills.
+
+    paid lists the bills whose share was paid, settled those of them
+    which are now paid off entirely, and missing the ids not found.
+    """
+
+    paid: list[int]
+    settled: list[int]
+    missing: list[int]
+
+
+class UtilityStats(NamedTuple):
+    """Store the bill count and unpaid total of a single utility."""
+
+    name: str
+    bill_count: int
+    unpaid_total: int
+
+
+class MonthTotal(NamedTuple):
+    """Store the amounts billed for a single YYYYMM month."""
+
+    period: int
+    total: float
+    unpaid: float
+
+
+class Balances(NamedTuple):
+    """Store the amounts owed by each user and the net settlement.
+
+    A positive net means user 1 owes user 2, a negative net the reverse.
+    """
+
+    user1: float
+    user2: float
+    net: float
+
+
+def to_period(month: str | int) -> int:
+    """Convert an 'MM-YY' month to a YYYYMM integer, passing integers on."""
+
+    if isinstance(month, int):
+        return month
+
+    periods = parse_periods(month)
+    if len(periods) != 1:
+        raise ValueError(f"Expected a single 'MM-YY' month, got {month!r}")
+    return periods[0]
+
+
+def connect(path: str, read_only: bool = False) -> sqlite3.Connection:
+    """Open a connection which may be handed between threads."""
+
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class ConnectionPool:
+    """Pool of read-only connections to a database file.
+
+    Connections are created on demand, so a thread never waits for one.
+    At most size idle connections are kept open for reuse.
+    """
+
+    def __init__(self, path: str, size: int = 4) -> None:
+        """Create an empty pool for the database at path."""
+
+        self.path = path
+        self.size = size
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+
+    def acquire(self) -> sqlite3.Connection:
+        """Take an idle connection, or open a new one."""
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.path, read_only=True)
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Return a connection to the pool, closing it if the pool is full."""
+
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    def close(self) -> None:
+        """Close every idle connection."""
+
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class QueryCache:
+    """Least recently used cache of query results.
+
+    Every result is stored with the generation of the cache it was
+    read in, and only counts as a hit during that generation.
+    invalidate starts a new generation, so a result read while a write
+    was being committed is never served after the write.
+    """
+
+    def __init__(self, size: int = 128) -> None:
+        """Create an empty cache holding at most size results."""
+
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries: OrderedDict[Hashable, tuple[int, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, generation: int) -> tuple[bool, Any]:
+        """Look up a result, returning whether it was found and current."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key: Hashable, generation: int, value: Any) -> None:
+        """Store a result, evicting the least recently used if full."""
+
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """Remove every result and start a new generation."""
+
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
 
 
 class Database:
-    """Interface to database in records.db."""
+    """Interface to database in records.db.
+
+    Writes go through a single writer connection, one transaction at a
+    time.  On a database file, reads borrow connections from a pool and
+    run in parallel with the writer thanks to WAL journaling.
+    Every call uses its own cursor, so a Database can be shared between
+    threads.
+    """
 
     def __init__(
-        self, debug: bool = False, setup: bool = False, **kwargs: str
+        self,
+        debug: bool = False,
+        setup: bool = False,
+        path: str = "records.db",
+        cache_size: int = 128,
+        **kwargs: str,
     ) -> None:
-        """Initialize database connection and establish cursor."""
+        """Initialize database connections."""
 
         self.debug = debug
         if debug is True:
-            self.conn = sqlite3.connect(":memory:")
+            self.conn = connect(":memory:")
+            self._pool = None
+            self._monitor = None
         else:
-            self.conn = sqlite3.connect("records.db")
+            self.conn = connect(path)
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self._pool = ConnectionPool(path)
+            # Idle connection whose data_version notices commits
+            # from other processes, see _notice_outside_writes
+            self._monitor = connect(path, read_only=True)
+            self._monitor_lock = threading.Lock()
+            self._data_version = self._read_data_version()
 
-        self.c = self.conn.cursor()
+        self._write_lock = threading.RLock()
+        self._write_owner: int | None = None
+        self._write_depth = 0
+
+        # Results of expensive queries, see _cached
+        self.cache = QueryCache(cache_size)
+
+        # Callbacks told about utility events once they are committed,
+        # and the events of the transaction in progress
+        self._subscribers: list[Subscriber] = []
+        self._events: list[tuple[str, str]] = []
+
+        # Directory of user names keyed by user id, loaded on first use.
+        # Reset to None whenever the users table is written to.
+        self._users: dict[int, str] | None = None
 
         if setup is True or debug is True:
             if debug is True:
                 kwargs = {"user1": "TestUser1", "user2": "TestUser2"}
             self.setup(kwargs)
 
+        migrate(self.conn)
+
+    def close(self) -> None:
+        """Close every connection to the database."""
+
+        if self._pool is not None:
+            self._pool.close()
+            self._monitor.close()
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Run statements in a transaction on the writer connection.
+
+        Only one thread can write at a time.  A transaction opened inside
+        another joins it, and everything is committed when the outermost
+        one finishes, or rolled back if it raises.  Subscribers are told
+        about the transaction's events after it has been committed.
+        """
+
+        with self._write_lock:
+            cursor = self.conn.cursor()
+            if self._write_depth:
+                self._write_depth += 1
+                try:
+                    yield cursor
+                finally:
+                    self._write_depth -= 1
+                return
+
+            self._write_depth = 1
+            self._write_owner = threading.get_ident()
+            try:
+                with self.conn:
+                    yield cursor
+                self.cache.invalidate()
+                events = self._events
+            finally:
+                self._write_depth = 0
+                self._write_owner = None
+                self._events = []
+
+        for event, utility in events:
+            for callback in list(self._subscribers):
+                callback(event, utility)
+
+    @contextmanager
+    def savepoint(self) -> Iterator[sqlite3.Cursor]:
+        """Run statements which can fail without ending the transaction.
+
+        It is meant for use inside a transaction.  If the statements
+        raise, their changes and the events they queued are discarded
+        before the error is raised again.
+        """
+
+        with self.transaction() as c:
+            queued = len(self._events)
+            c.execute("SAVEPOINT nested_write")
+            try:
+                yield c
+            except BaseException:
+                c.execute("ROLLBACK TO nested_write")
+                c.execute("RELEASE nested_write")
+                del self._events[queued:]
+                raise
+            c.execute("RELEASE nested_write")
+
+    def subscribe(self, callback: Subscriber) -> None:
+        """Call callback(event, utility) whenever a utility changes.
+
+        The event is UTILITY_ADDED when a utility is created, either by
+        add_utility or by adding a bill for a new utility, and
+        UTILITY_REMOVED when remove_utility removes one.
+        Only changes made through this Database are reported.
+        """
+
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Subscriber) -> None:
+        """Stop calling a subscribed callback."""
+
+        self._subscribers.remove(callback)
+
+    @staticmethod
+    def _utility_id(c: sqlite3.Cursor, utility: str) -> int | None:
+        """Return the id of a utility, or None if there is no such utility."""
+
+        c.execute("SELECT id FROM utilities WHERE name = ?", (utility,))
+        row = c.fetchone()
+        return None if row is None else row[0]
+
+    def change_token(self) -> str:
+        """Return a token which changes whenever the database changes.
+
+        It combines the database's epoch with the version which triggers
+        bump on every write, so it changes with commits from any
+        connection or process.  Only committed writes are seen, except
+        by the thread of a transaction in progress.
+        """
+
+        with self._reader() as conn:
+            epoch, version = conn.execute(
+                "SELECT epoch, version FROM changes"
+            ).fetchone()
+        return f"{epoch}-{version}"
+
+    def _cached(self, key: tuple, load: Callable[[], Any]) -> Any:
+        """Return a copy of a cached query result, loading it if needed.
+
+        key names the method and its arguments.  The cache is emptied
+        whenever a transaction commits, and bypassed by the thread of a
+        transaction in progress, since its results could then depend on
+        changes which are not committed yet.
+        """
+
+        if self._write_owner == threading.get_ident():
+            return load()
+        self._notice_outside_writes()
+
+        generation = self.cache.generation
+        found, value = self.cache.get(key, generation)
+        if not found:
+            value = load()
+            self.cache.put(key, generation, value)
+        return copy(value)
+
+    def _notice_outside_writes(self) -> None:
+        """Empty the cache if another process has committed since last time.
+
+        The monitor connection never writes, so its data_version only
+        changes when some other connection commits.  In-memory databases
+        cannot be opened by anyone else.
+        """
+
+        if self._monitor is None:
+            return
+        version = self._read_data_version()
+        if version != self._data_version:
+            self._data_version = version
+            self.cache.invalidate()
+
+    def _read_data_version(self) -> int:
+        """Read PRAGMA data_version on the monitor connection."""
+
+        with self._monitor_lock:
+            return self._monitor.execute("PRAGMA data_version").fetchone()[0]
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Lend a connection for reading.
+
+        The writer connection is used while this thread has a transaction
+        open, so that it sees its own uncommitted changes, and for
+        in-memory databases, which other connections cannot open.
+        Threads sharing the in-memory connection take turns with it,
+        holding the write lock until they are done reading.
+        """
+
+        if self._write_owner == threading.get_ident():
+            yield self.conn
+            return
+
+        if self._pool is None:
+            with self._write_lock:
+                yield self.conn
+            return
+
+        conn = self._pool.acquire()
+        try:
+            yield conn
+        finally:
+            self._pool.release(conn)
+
+    def _fetchall(self, query: str, params: Any = ()) -> list:
+        """Run a read query and return all of its rows."""
+
+        with self._reader() as conn:
+            return conn.execute(query, params).fetchall()
+
     def setup(self, kwargs: dict) -> None:
         """Set up a database if database not found or in debugging mode."""
 
-        with self.conn:
-            self.c.execute(
+        with self.transaction() as c:
+            c.execute(
                 """
                     CREATE TABLE bills (
                     id integer primary key,
@@ -56,7 +503,7 @@ class Database:
                     )"""
             )
 
-            self.c.execute(
+            c.execute(
                 """
                     CREATE TABLE users (
                     id integer primary key,
@@ -64,7 +511,7 @@ class Database:
                     )"""
             )
 
-            self.c.execute(
+            c.execute(
                 """
                 INSERT INTO users VALUES
                 (NULL, :user1),
@@ -72,9 +519,10 @@ class Database:
                 """,
                 {"user1": kwargs.get("user1"), "user2": kwargs.get("user2")},
             )
+            self._users = None
 
             if self.debug is True:
-                self.c.execute(
+                c.execute(
                     """
                     INSERT INTO bills VALUES
                     (NULL, "gas", "05-21", 2000, 1, 0, 0, "Test Note"),
@@ -86,82 +534,294 @@ class Database:
                     """
                 )
 
+    def rebuild_balances(self) -> tuple[Balances, Balances]:
+        """Recompute the balances and utility summaries from the bills.
+
+        Returns the balances as they were before the rebuild and after it,
+        so that callers can check whether the two had drifted apart.
+        """
+
+        before = self.get_balances()
+        with self.transaction() as c:
+            c.execute(REBUILD_BALANCES)
+            c.execute(REBUILD_UTILITIES)
+        return before, self.get_balances()
+
     def get_user(self, user_id: int) -> str:
         """Get name of user at user_id."""
 
-        self.c.execute("SELECT * FROM users WHERE id=:id", {"id": user_id})
-        return self.c.fetchone()[1]
+        return self.get_users()[user_id]
+
+    def get_users(self) -> dict[int, str]:
+        """Return the cached user directory, loading it if necessary."""
+
+        users = self._users
+        if users is None:
+            users = self._users = dict(
+                self._fetchall("SELECT id, name FROM users")
+            )
+        return users
+
+    def add_user(self, name: str) -> int:
+        """Add a user who can take part in bills and return their id."""
+
+        if name.lower() in self._user_ids():
+            raise ValueError(f"There is already a user named {name}.")
+
+        with self.transaction() as c:
+            c.execute("INSERT INTO users (name) VALUES (?)", (name,))
+            self._users = None
+            return c.lastrowid
+
+    def _user_ids(self) -> dict[str, int]:
+        """Return user ids keyed by lowercase user name."""
+
+        users = self.get_users()
+        return {name.lower(): user_id for user_id, name in users.items()}
+
+    def _user_id(self, user: str) -> int:
+        """Return the id of a user, raising ValueError if there is none."""
+
+        try:
+            return self._user_ids()[user.lower()]
+        except KeyError:
+            raise ValueError(f"There is no user named {user}.") from None
+
+    def add_utility(self, utility: str) -> bool:
+        """Add a utility without any bills, unless it already exists.
+
+        Returns whether the utility was added.
+        """
+
+        with self.transaction() as c:
+            c.execute(INSERT_UTILITY, (utility,))
+            if not c.rowcount:
+                return False
+            self._events.append((UTILITY_ADDED, utility))
+        return True
 
     def remove_utility(self, utility: str) -> None:
         """Remove a utility and all associated bills."""
 
-        with self.conn:
-            self.c.execute(
-                "DELETE FROM bills WHERE utility=:utility",
-                {"utility": utility},
+        with self.transaction() as c:
+            utility_id = self._utility_id(c, utility)
+            if utility_id is None:
+                return
+
+            c.execute(
+                "DELETE FROM bills WHERE utility_id = ?", (utility_id,)
             )
+            c.execute("DELETE FROM utilities WHERE id = ?", (utility_id,))
+            self._events.append((UTILITY_REMOVED, utility))
 
     def add_bill(self, bill: Bill) -> None:
         """Add a bill to the database."""
 
-        with self.conn:
-            self.c.execute(
-                """
-                INSERT INTO bills VALUES
-                (NULL, :utility,
-                :date, :amount,
-                :user1_paid, :user2_paid,
-                :paid, :note)
-                """,
-                {
-                    "utility": bill.utility,
-                    "date": bill.date,
-                    "amount": bill.amount,
-                    "user1_paid": bill.user1_paid,
-                    "user2_paid": bill.user2_paid,
-                    "paid": bill.paid,
-                    "note": bill.note,
-                },
-            )
+        with self.transaction() as c:
+            new = self._utility_id(c, bill.utility) is None
+            if new:
+                c.execute(INSERT_UTILITY, (bill.utility,))
+            c.execute(INSERT_BILL, self._bill_params(bill))
+            if new:
+                self._events.append((UTILITY_ADDED, bill.utility))
+
+    def add_bills(self, bills: Iterable[Bill], chunk_size: int = 1000) -> int:
+        """Add many bills in a single transaction and return how many.
+
+        Bills are consumed from the iterable chunk_size at a time,
+        so arbitrarily long streams are inserted with bounded memory.
+        """
+
+        bills = iter(bills)
+        count = 0
+        seen: set[str] = set()
+        with self.transaction() as c:
+            while chunk := [
+                self._bill_params(bill) for bill in islice(bills, chunk_size)
+            ]:
+                new = []
+                for utility in dict.fromkeys(row["utility"] for row in chunk):
+                    if utility not in seen:
+                        seen.add(utility)
+                        if self._utility_id(c, utility) is None:
+                            new.append(utility)
+                c.executemany(INSERT_UTILITY, [(name,) for name in new])
+
+                c.executemany(INSERT_BILL, chunk)
+                count += len(chunk)
+                self._events.extend((UTILITY_ADDED, name) for name in new)
+        return count
+
+    @staticmethod
+    def _bill_params(bill: Bill) -> dict:
+        """Return the query parameters used to insert a bill."""
+
+        return {
+            "utility": bill.utility,
+            "date": bill.date,
+            "amount": bill.amount,
+            "user1_paid": bill.user1_paid,
+            "user2_paid": bill.user2_paid,
+            "paid": bill.paid,
+            "note": bill.note,
+        }
 
     def remove_bill(self, bill: Any) -> None:
         """Remove a bill from the database."""
 
-        with self.conn:
+        with self.transaction() as c:
             try:
-                self.c.execute(
-                    "DELETE FROM bills WHERE id=:id", {"id": bill.id}
-                )
+                c.execute("DELETE FROM bills WHERE id=:id", {"id": bill.id})
             except AttributeError:
-                self.c.execute("DELETE FROM bills WHERE id=:id", {"id": bill})
+                c.execute("DELETE FROM bills WHERE id=:id", {"id": bill})
 
-    def pay_bill(self, bill: Bill) -> None:
-        """Pay a bill with new values already set on Bill parameter."""
+    def pay_bills(
+        self,
+        ids: Iterable[int],
+        user: str,
+        utility: str | None = None,
+        paid_at: str | None = None,
+    ) -> PaymentResult:
+        """Pay a user's portion of many bills in a single transaction.
 
-        with self.conn:
-            self.c.execute(
-                """
-                UPDATE bills
-                SET user1_paid = :user1_paid,
-                    user2_paid = :user2_paid,
-                    paid = :paid,
-                    note = :note
-                WHERE id = :id
-                """,
-                {
-                    "user2_paid": bill.user2_paid,
-                    "user1_paid": bill.user1_paid,
-                    "paid": bill.paid,
-                    "note": bill.note,
-                    "id": bill.id,
-                },
+        Bills are looked up by id, optionally only within one utility.
+        Bills where the user has no share, or has already paid it, are
+        left untouched.  Each payment is appended to the payments ledger.
+        Raises ValueError if there is no user with the given name.
+        """
+
+        if paid_at is None:
+            paid_at = datetime.now().isoformat(sep=" ", timespec="seconds")
+
+        ids = list(dict.fromkeys(ids))
+        user_id = self._user_id(user)
+
+        with self.transaction() as c:
+            # Whether the user's share of each bill found is paid,
+            # or None if the user has no share of it
+            shares: dict[int, int | None] = {}
+            for start in range(0, len(ids), 500):
+                chunk = ids[start : start + 500]
+                query = f"""
+                    SELECT bills.id, share.paid FROM bills
+                    LEFT JOIN bill_shares AS share
+                    ON share.bill_id = bills.id AND share.user_id = ?
+                    WHERE bills.id IN ({', '.join('?' * len(chunk))})
+                    """
+                params: list = [user_id, *chunk]
+                if utility is not None:
+                    query += """
+                        AND bills.utility_id = (
+                            SELECT id FROM utilities WHERE name = ?
+                        )
+                        """
+                    params.append(utility)
+                c.execute(query, params)
+                shares.update(c.fetchall())
+
+            payments = [
+                {"bill_id": bill_id, "user_id": user_id, "paid_at": paid_at}
+                for bill_id in ids
+                if shares.get(bill_id, 1) == 0
+            ]
+            c.executemany(PAY_SHARE, payments)
+            c.executemany(INSERT_PAYMENT, payments)
+
+            paid = [payment["bill_id"] for payment in payments]
+            settled: set[int] = set()
+            for start in range(0, len(paid), 500):
+                chunk = paid[start : start + 500]
+                c.execute(
+                    f"""
+                    SELECT id FROM bills WHERE paid = 1
+                    AND id IN ({', '.join('?' * len(chunk))})
+                    """,
+                    chunk,
+                )
+                settled.update(row[0] for row in c.fetchall())
+
+        return PaymentResult(
+            paid,
+            [bill_id for bill_id in paid if bill_id in settled],
+            [bill_id for bill_id in ids if bill_id not in shares],
+        )
+
+    def get_payments(
+        self, bill_id: int | None = None, user: str | None = None
+    ) -> list[Payment]:
+        """Get payments from the ledger, oldest first.
+
+        Payments can be limited to a single bill, a single user, or both.
+        Raises ValueError if there is no user with the given name.
+        """
+
+        conditions = []
+        params: dict[str, Any] = {}
+        if bill_id is not None:
+            conditions.append("bill_id = :bill_id")
+            params["bill_id"] = bill_id
+        if user is not None:
+            conditions.append("user_id = :user_id")
+            params["user_id"] = self._user_id(user)
+
+        query = "SELECT id, bill_id, user_id, amount, paid_at FROM payments"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY paid_at, id"
+
+        users = self.get_users()
+        return [
+            Payment(payment_id, paid_bill, users[user_id], amount, paid_at)
+            for payment_id, paid_bill, user_id, amount, paid_at in (
+                self._fetchall(query, params)
             )
+        ]
 
     def get_all_records(self) -> list[Bill]:
         """Select all records in database."""
 
-        self.c.execute("SELECT * FROM bills")
-        return self._fetchall_and_convert()
+        return list(self.iter_all_records())
+
+    def iter_all_records(self) -> Iterator[Bill]:
+        """Iterate over all records in database."""
+
+        return self._iter_query(SELECT_BILLS)
+
+    def iter_bill_rows(self, batch_size: int = 500) -> Iterator[tuple]:
+        """Yield raw bill rows without their ids, batch_size at a time.
+
+        Only the bills themselves are included, not their payments
+        or shares, so the rows are no substitute for a backup.
+        A dedicated cursor is used so other queries can run while
+        the rows are being consumed.
+        """
+
+        with self._reader() as conn:
+            cursor = conn.execute(
+                """
+                SELECT
+                    utility, date, amount, user1_paid, user2_paid, paid, note
+                FROM bills ORDER BY id
+                """
+            )
+            while rows := cursor.fetchmany(batch_size):
+                yield from rows
+
+    def get_bill_batch(self, batch_size: int = 500) -> BillBatch:
+        """Load every bill into a columnar BillBatch without notes."""
+
+        batch = BillBatch()
+        with self._reader() as conn:
+            cursor = conn.execute(
+                """
+                SELECT id, utility, date, amount, user1_paid, user2_paid, paid,
+                user1_share, user2_share
+                FROM bills ORDER BY id
+                """
+            )
+            while rows := cursor.fetchmany(batch_size):
+                batch.extend(rows)
+        return batch
 
     def get_record(self, bill: int | Bill) -> Any:
         """Get a record, accepting either a bill id or a Bill object."""
@@ -170,78 +830,408 @@ class Database:
             # First check that bill is a Bill object
             if TYPE_CHECKING:
                 assert isinstance(bill, Bill)
-            self.c.execute("SELECT * FROM bills WHERE id=:id", {"id": bill.id})
+            bill_id = bill.id
 
         except AttributeError:
             # Next check that bill is a bill ID
-            self.c.execute("SELECT * FROM bills WHERE id=:id", {"id": bill})
+            bill_id = bill
 
+        records = self._fetchall(
+            f"{SELECT_BILLS} WHERE id=:id", {"id": bill_id}
+        )
         try:
-            return self._convert_to_object(self.c.fetchone())
-        except TypeError:
+            return self._convert_to_object(records[0])
+        except IndexError:
             return None
 
     def get_utilities(self) -> list:
-        """Return a list of all utilities present in the database."""
+        """Return a list of all utilities present in the database.
 
-        self.c.execute("SELECT DISTINCT utility FROM bills")
-        return self.c.fetchall()
+        Utilities are listed even when they have no bills.
+        """
+
+        return self._fetchall("SELECT name FROM utilities ORDER BY name")
+
+    def get_utility_stats(self) -> list[UtilityStats]:
+        """Return the bill count and unpaid total of every utility."""
+
+        return [
+            UtilityStats(*row)
+            for row in self._fetchall(
+                """
+                SELECT name, bill_count, unpaid_total
+                FROM utilities ORDER BY name
+                """
+            )
+        ]
 
     def get_utility_record(self, utility: str) -> list[Bill]:
         """Get a list of bills associated with a provided utility."""
 
-        self.c.execute(
-            "SELECT * FROM bills WHERE utility=:utility", {"utility": utility}
+        return list(self.iter_utility_record(utility))
+
+    def iter_utility_record(self, utility: str) -> Iterator[Bill]:
+        """Iterate over the bills associated with a provided utility."""
+
+        return self._iter_query(
+            f"{SELECT_BILLS} WHERE {UTILITY_BILLS}", {"utility": utility}
         )
-        return self._fetchall_and_convert()
+
+    def get_utility_page(
+        self,
+        utility: str,
+        after_id: int = 0,
+        before_id: int | None = None,
+        limit: int = PAGE_SIZE,
+        owed_by: str | None = None,
+    ) -> list[Bill]:
+        """Get one page of bills for a utility, using ids as the cursor.
+
+        The page holds the bills following after_id, or the bills
+        preceding before_id when it is given, always in ascending id order.
+        owed_by limits the page to bills where that user has a share
+        which is not paid yet.
+        """
+
+        conditions = [UTILITY_BILLS]
+        if before_id is None:
+            conditions.append("id > :after_id")
+            order = "ASC"
+        else:
+            conditions.append("id < :before_id")
+            order = "DESC"
+
+        user_id = None
+        if owed_by is not None:
+            user_id = self._user_id(owed_by)
+            conditions.append(
+                """EXISTS (
+                    SELECT 1 FROM bill_shares
+                    WHERE bill_id = bills.id
+                    AND user_id = :user_id AND paid = 0
+                )"""
+            )
+
+        records = self._convert_all(
+            self._fetchall(
+                f"""
+                {SELECT_BILLS}
+                WHERE {" AND ".join(conditions)}
+                ORDER BY id {order}
+                LIMIT :limit
+                """,
+                {
+                    "utility": utility,
+                    "after_id": after_id,
+                    "before_id": before_id,
+                    "user_id": user_id,
+                    "limit": limit,
+                },
+            )
+        )
+        if before_id is not None:
+            records.reverse()
+        return records
 
     def get_unpaid_bills(self) -> list[Bill]:
         """Get a list of all unpaid bills."""
 
-        self.c.execute("SELECT * FROM bills WHERE paid=False")
-        return self._fetchall_and_convert()
+        return list(self.iter_unpaid_bills())
+
+    def iter_unpaid_bills(self) -> Iterator[Bill]:
+        """Iterate over all unpaid bills."""
+
+        return self._iter_query(f"{SELECT_BILLS} WHERE paid = 0")
 
     def get_paid_bills(self) -> list[Bill]:
         """Get a list of all paid off bills."""
 
-        self.c.execute("SELECT * FROM bills WHERE paid=True")
-        return self._fetchall_and_convert()
+        return list(self.iter_paid_bills())
+
+    def iter_paid_bills(self) -> Iterator[Bill]:
+        """Iterate over all paid off bills."""
+
+        return self._iter_query(f"{SELECT_BILLS} WHERE paid = 1")
+
+    def get_bills_between(
+        self, start: str | int, end: str | int
+    ) -> list[Bill]:
+        """Get bills covering any month from start to end inclusive.
+
+        Months are given either as 'MM-YY' strings or YYYYMM integers.
+        """
+
+        return self._convert_all(
+            self._fetchall(
+                f"""
+                {SELECT_BILLS} WHERE id IN (
+                    SELECT bill_id FROM bill_periods
+                    WHERE period BETWEEN :start AND :end
+                )
+                ORDER BY id
+                """,
+                {"start": to_period(start), "end": to_period(end)},
+            )
+        )
+
+    def get_monthly_totals(
+        self, start: str | int, end: str | int
+    ) -> list[MonthTotal]:
+        """Get the billed and unpaid amounts for each month in a range.
+
+        A bill covering several months is split evenly between them.
+        """
+
+        rows = self._fetchall(
+            """
+            SELECT
+                p.period,
+                TOTAL(b.amount * p.weight),
+                TOTAL(CASE WHEN b.paid = 0 THEN b.amount * p.weight END)
+            FROM bill_periods AS p
+            JOIN bills AS b ON b.id = p.bill_id
+            WHERE p.period BETWEEN :start AND :end
+            GROUP BY p.period
+            ORDER BY p.period
+            """,
+            {"start": to_period(start), "end": to_period(end)},
+        )
+        return [MonthTotal(*row) for row in rows]
 
     def get_bills_owed(self, user: str) -> list[Bill]:
         """Get a list of bills owed by a given user."""
 
-        if user == self.get_user(1).lower():
-            self.c.execute("SELECT * FROM bills WHERE user1_paid=False")
-        else:
-            self.c.execute("SELECT * FROM bills WHERE user2_paid=False")
+        return list(self.iter_bills_owed(user))
+
+    def iter_bills_owed(self, user: str) -> Iterator[Bill]:
+        """Iterate over the bills where a given user has an unpaid share."""
 
-        return self._fetchall_and_convert()
+        return self._iter_query(
+            f"""
+            {SELECT_BILLS} WHERE id IN (
+                SELECT bill_id FROM bill_shares
+                WHERE user_id = :user_id AND paid = 0
+            )
+            ORDER BY id
+            """,
+            {"user_id": self._user_id(user)},
+        )
 
     def get_total_owed(self, user: str) -> float:
-        """Get a total of the amount owed by a given user."""
+        """Get a total of the amount owed by user 1 or user 2.
 
-        if user == self.get_user(1).lower():
-            self.c.execute("SELECT * FROM bills WHERE user1_paid=False")
-        else:
-            self.c.execute("SELECT * FROM bills WHERE user2_paid=False")
+        Raises ValueError for any other user, since the balances
+        summary only covers the first two users.
+        """
+
+        user_id = self._user_id(user)
+        if user_id not in (1, 2):
+            raise ValueError(
+                f"Totals are only kept for {self.get_user(1)} "
+                f"and {self.get_user(2)}."
+            )
+
+        balances = self.get_balances()
+        return balances.user1 if user_id == 1 else balances.user2
 
-        records = [NamedRecord(*record) for record in self.c.fetchall()]
+    def get_balances(self) -> Balances:
+        """Get the totals owed by users 1 and 2 from the balances summary.
 
-        total_owed = 0.0
-        for bill in records:
-            total_owed += bill.cost / 2
-        return total_owed
+        Each user owes their share of every bill they have not paid,
+        weighted as set with set_shares.  Shares such as thirds leave
+        floating point noise in the running totals, so they are rounded
+        to hundredths of a yen.
+        """
+
+        user1_total, user2_total = self._fetchall(
+            "SELECT user1_owed, user2_owed FROM balances"
+        )[0]
+        user1_owed = round(user1_total, 2)
+        user2_owed = round(user2_total, 2)
+        return Balances(
+            user1_owed, user2_owed, round(user1_owed - user2_owed, 2)
+        )
+
+    def set_shares(self, bill_id: int, weights: dict[str, float]) -> None:
+        """Split a bill between the given users in proportion to weights.
+
+        Users already sharing the bill keep their paid flag, new users
+        start unpaid, and users left out no longer take part.  Users 1
+        and 2 have a share of 0 on the bill itself while left out, so the
+        two-user balances do not count a share they no longer have.
+        """
+
+        if not weights or min(weights.values()) <= 0:
+            raise ValueError("Every share needs a positive weight.")
+        shares = {
+            self._user_id(user): weight for user, weight in weights.items()
+        }
+
+        with self.transaction() as c:
+            c.execute(
+                f"""
+                DELETE FROM bill_shares WHERE bill_id = ?
+                AND user_id NOT IN ({", ".join("?" * len(shares))})
+                """,
+                (bill_id, *shares),
+            )
+            c.executemany(
+                """
+                INSERT INTO bill_shares (bill_id, user_id, weight)
+                VALUES (?, ?, ?)
+                ON CONFLICT (bill_id, user_id)
+                DO UPDATE SET weight = excluded.weight
+                """,
+                [
+                    (bill_id, user_id, weight)
+                    for user_id, weight in shares.items()
+                ],
+            )
+            c.execute(
+                """
+                UPDATE bills SET paid = NOT EXISTS (
+                    SELECT 1 FROM bill_shares
+                    WHERE bill_id = :id AND paid = 0
+                )
+                WHERE id = :id
+                """,
+                {"id": bill_id},
+            )
 
-    def _fetchall_and_convert(self) -> list[Bill]:
-        """Return a list of Bills retrieved after a query."""
+    def get_shares(self, bill_id: int) -> list[Share]:
+        """Get the shares of a bill, identifying users by name."""
 
+        users = self.get_users()
         return [
-            self._convert_to_object(record) for record in self.c.fetchall()
+            Share(users[user_id], weight, bool(paid))
+            for user_id, weight, paid in self._fetchall(
+                """
+                SELECT user_id, weight, paid FROM bill_shares
+                WHERE bill_id = ? ORDER BY user_id
+                """,
+                (bill_id,),
+            )
         ]
 
-    def _convert_to_object(self, record) -> Bill:
+    def pay_share(
+        self, bill_id: int, user: str, paid_at: str | None = None
+    ) -> bool:
+        """Pay a user's share of a bill and record it in the ledger.
+
+        Returns False if the user has no unpaid share of the bill.
+        """
+
+        if paid_at is None:
+            paid_at = datetime.now().isoformat(sep=" ", timespec="seconds")
+        user_id = self._user_id(user)
+
+        with self.transaction() as c:
+            c.execute(
+                """
+                UPDATE bill_shares SET paid = 1
+                WHERE bill_id = ? AND user_id = ? AND paid = 0
+                """,
+                (bill_id, user_id),
+            )
+            if not c.rowcount:
+                return False
+
+            c.execute(
+                INSERT_PAYMENT,
+                {"bill_id": bill_id, "user_id": user_id, "paid_at": paid_at},
+            )
+        return True
+
+    def iter_bill_shares(self) -> Iterator[tuple[int, list[Share]]]:
+        """Yield the amount and shares of every partly paid bill.
+
+        Bills whose shares are all paid or all unpaid are skipped,
+        since they leave nobody owing anybody else.
+        """
+
+        users = self.get_users()
+        with self._reader() as conn:
+            cursor = conn.execute(
+                """
+                SELECT bills.id, bills.amount, share.user_id,
+                share.weight, share.paid
+                FROM bills
+                JOIN bill_shares AS share ON share.bill_id = bills.id
+                WHERE bills.paid = 0 AND EXISTS (
+                    SELECT 1 FROM bill_shares AS paid_share
+                    WHERE paid_share.bill_id = bills.id
+                    AND paid_share.paid = 1
+                )
+                ORDER BY bills.id
+                """
+            )
+            bill_id = None
+            amount = 0
+            shares: list[Share] = []
+            while rows := cursor.fetchmany(500):
+                for row_bill, row_amount, user_id, weight, paid in rows:
+                    if row_bill != bill_id:
+                        if shares:
+                            yield amount, shares
+                        bill_id, amount, shares = row_bill, row_amount, []
+                    shares.append(Share(users[user_id], weight, bool(paid)))
+            if shares:
+                yield amount, shares
+
+    def get_net_balances(self) -> dict[str, float]:
+        """Net amount owed to each user, negative if they owe others.
+
+        Every share of every bill is read, so the result is cached.
+        """
+
+        return self._cached(("get_net_balances",), self._load_net_balances)
+
+    def _load_net_balances(self) -> dict[str, float]:
+        """Work out the net balances from every bill share."""
+
+        balances = net_balances(self.iter_bill_shares())
+        return {
+            name: balances.get(name, 0.0) for name in self.get_users().values()
+        }
+
+    def get_settlement(self, exact: bool | None = None) -> list[Transfer]:
+        """Plan the transfers which settle every user's net balance.
+
+        See splitting.plan_settlement for the meaning of exact.
+        """
+
+        return plan_settlement(self.get_net_balances(), exact)
+
+    def _iter_query(
+        self, query: str, params: dict | None = None, batch_size: int = 500
+    ) -> Iterator[Bill]:
+        """Run a query and yield its rows as Bills, batch_size at a time.
+
+        The query runs on its own cursor, so other queries can be
+        made while the results are being consumed.
+        """
+
+        users = self.get_users()
+        with self._reader() as conn:
+            cursor = conn.execute(query, params or {})
+            while rows := cursor.fetchmany(batch_size):
+                for record in rows:
+                    yield self._convert_to_object(record, users)
+
+    def _convert_all(self, records: list) -> list[Bill]:
+        """Convert a list of database entries to Bill objects."""
+
+        users = self.get_users()
+        return [self._convert_to_object(record, users) for record in records]
+
+    def _convert_to_object(
+        self, record, users: dict[int, str] | None = None
+    ) -> Bill:
         """Take a database entry and convert it to a Bill object."""
 
+        if users is None:
+            users = self.get_users()
+
         named_record = NamedRecord(*record)
         return Bill(
             named_record.utility,
@@ -252,6 +1242,8 @@ class Database:
             paid=named_record.paid,
             note=named_record.note,
             primary_key=named_record.Id,
-            user1=self.get_user(1),
-            user2=self.get_user(2),
+            user1_share=named_record.user1_share,
+            user2_share=named_record.user2_share,
+            user1=users[1],
+            user2=users[2],
         )
@@ -0,0 +1,68 @@
+"""
+Generated bills and databases shared by the tests, benchmarks and
+load test.
+"""
+
+from random import choice, randint
+
+from bill import Bill
+from database import Database
+
+
+def generate_bill(**kwargs) -> Bill:
+    """Generate a bill with random values for any value not given."""
+
+    utility = kwargs.get("utility") or choice(
+        ("electric", "rent", "gas", "water")
+    )
+    amount = int(kwargs.get("amount") or randint(2000, 10000))
+    date = kwargs.get("date") or choice(
+        ("02-17", "03-17,04-17", "10-18", "10-20")
+    )
+
+    user1_paid = kwargs.get("user1_paid")
+    if user1_paid not in (True, False):
+        user1_paid = choice((True, False))
+    user2_paid = kwargs.get("user2_paid")
+    if user2_paid not in (True, False):
+        user2_paid = choice((True, False))
+
+    return Bill(
+        utility,
+        date,
+        amount,
+        user1_paid=user1_paid,
+        user2_paid=user2_paid,
+        paid=user1_paid and user2_paid,
+        note="Test Note",
+    )
+
+
+def utility_names(count: int) -> list[str]:
+    """Return count utility names for generated bills."""
+
+    return [f"utility{number}" for number in range(count)]
+
+
+def seeded_database(
+    size: int, utilities: int | None = None, path: str | None = None
+) -> Database:
+    """Return a debugging database holding size generated bills.
+
+    By default the bills are spread over the usual four utilities,
+    otherwise over the given number of generated utility names.
+    The database is kept in memory unless a new file's path is given.
+    """
+
+    names = utility_names(utilities) if utilities else None
+    if path is None:
+        db = Database(debug=True)
+    else:
+        db = Database(
+            setup=True, path=path, user1="TestUser1", user2="TestUser2"
+        )
+    db.add_bills(
+        generate_bill(utility=choice(names) if names else None)
+        for _ in range(size)
+    )
+    return db
@@ -1,12 +1,17 @@
 import sys
 import os
 
-from shutil import copy2
-from csv import writer
 from typing import Optional, Any, TypeAlias
 from datetime import datetime
+from time import perf_counter
 
+from backup import BackupError, backup, print_progress, restore
+from batch import BatchError, format_result, run_batch
+from bill_io import read_bills, write_bills
 from database import Database
+from migrations import query_plans
+from server import serve
+from splitting import format_settlement, plan_settlement
 
 def cmd_line_arg_handler() -> dict:
     """Handle command line arguments."""
@@ -22,9 +27,25 @@ def cmd_line_arg_handler() -> dict:
                 "Accepted command line arguments:\n"
                 '"-v" or "--version": Display version information\n'
                 '"-b" or "--backup": Backup database\n'
+                '"--incremental": With "--backup", only copy pages\n'
+                "changed since the last backup.\n"
                 '"-r" or "--restore": Restore database from backup\n'
-                '"-e" or "--export": Export a list of Bill objects\n'
-                "for use in database recovery.\n"
+                '"-e [FILE]" or "--export [FILE]": Export all bills to a\n'
+                ".csv or .jsonl file (bill_list.csv by default).\n"
+                "Payments and shares are not exported, so use\n"
+                '"--backup" to keep a copy for database recovery.\n'
+                '"-i FILE" or "--import FILE": Import bills from a\n'
+                ".csv or .jsonl file.\n"
+                '"--rebuild-balances": Recompute the balances summary\n'
+                "from the bills table.\n"
+                '"--report": Print totals by utility, user and month\n'
+                '"--query-plans": Show how SQLite runs indexed queries\n'
+                '"--settle [exact|greedy]": Plan the transfers which\n'
+                "settle every user's balance (exact for small groups).\n"
+                '"--batch [FILE]": Run add, pay and remove commands from\n'
+                "a file, or standard input, in one transaction.\n"
+                '"--serve [PORT]": Serve bills as JSON over HTTP on\n'
+                "localhost (port 8000 by default).\n"
                 '"-d" or "--debug": Enter debugging mode\n'
             )
             sys.exit()
@@ -34,17 +55,31 @@ def cmd_line_arg_handler() -> dict:
             sys.exit()
 
         if "-b" in opts or "--backup" in opts:
-            print("Backing up database...")
+            incremental = "--incremental" in opts
+            if incremental:
+                print("Backing up changes to database...")
+            else:
+                print("Backing up database...")
 
             destination_address = os.environ.get(
                 "Utilities-Calculator-Backup-Address", ""
             )
 
-            copy2("records.db", destination_address)
+            try:
+                result = backup(
+                    "records.db",
+                    destination_address,
+                    incremental=incremental,
+                    progress=print_progress,
+                )
+            except BackupError as error:
+                sys.exit(f"Backup aborted: {error}")
 
             print(
                 f"Database has successfully been backed up "
-                "to {destination_address}."
+                f"to {destination_address} "
+                f"({result.pages_written} of {result.pages_total} "
+                "pages written)."
             )
             sys.exit()
 
@@ -56,21 +91,125 @@ def cmd_line_arg_handler() -> dict:
             destination_address = os.environ.get(
                 "Utilities-Calculator-Address", ""
             )
-            copy2(f"{original_address}/records.db", destination_address)
+
+            try:
+                restore(
+                    original_address,
+                    os.path.join(destination_address, "records.db"),
+                    progress=print_progress,
+                )
+            except BackupError as error:
+                sys.exit(f"Restore aborted: {error}")
+
+            print("Database has successfully been restored.")
             sys.exit()
 
         if "-e" in opts or "--export" in opts:
+            path = flag_argument("-e", "--export") or "bill_list.csv"
+
             print("Exporting database entries...")
             db = Database(debug=False)
-            all_records = db.get_all_records()
+            count = write_bills(db.iter_bill_rows(), path)
+            db.close()
+
+            print(f"{count} database entries exported to {path}!")
+            sys.exit()
+
+        if "-i" in opts or "--import" in opts:
+            path = flag_argument("-i", "--import")
+            if not path:
+                sys.exit("Please provide a file to import.")
+
+            print(f"Importing bills from {path}...")
+            db = Database(debug=False)
+            start = perf_counter()
+            count = db.add_bills(read_bills(path))
+            elapsed = perf_counter() - start
+            db.close()
+
+            rate = count / elapsed if elapsed else 0
+            print(
+                f"Imported {count} bills in {elapsed:.2f} seconds "
+                f"({rate:.0f} rows/sec)."
+            )
+            sys.exit()
+
+        if "--rebuild-balances" in opts:
+            print("Rebuilding balances summary...")
+            db = Database(debug=False)
+            before, after = db.rebuild_balances()
+            db.close()
+
+            if before == after:
+                print("Balances summary was already up to date.")
+            else:
+                print(
+                    "Balances summary has been corrected.\n"
+                    f"Before: {before.user1} / {before.user2} yen\n"
+                    f"After: {after.user1} / {after.user2} yen"
+                )
+            sys.exit()
+
+        if "--report" in opts:
+            try:
+                from reports import build_report, format_report
+            except ImportError:
+                sys.exit("Reports require NumPy to be installed.")
+
+            db = Database(debug=False)
+            report = build_report(db.get_bill_batch())
+            print(format_report(report, db.get_user(1), db.get_user(2)))
+            db.close()
+            sys.exit()
+
+        if "--settle" in opts:
+            mode = flag_argument("--settle")
+            if mode not in (None, "exact", "greedy"):
+                sys.exit('Please choose "exact" or "greedy".')
+
+            db = Database(debug=False)
+            start = perf_counter()
+            balances = db.get_net_balances()
+            transfers = plan_settlement(
+                balances, exact=None if mode is None else mode == "exact"
+            )
+            elapsed = perf_counter() - start
+            db.close()
+
+            print(format_settlement(balances, transfers))
+            print(f"Planned in {elapsed * 1000:.1f} ms.")
+            sys.exit()
 
-            with open("bill_list.csv", "w", newline="") as file:
-                csv_writer = writer(file)
-                csv_writer.writerow(["bills ="])
-                for record in all_records:
-                    csv_writer.writerow([record.__repr__()])
+        if "--query-plans" in opts:
+            db = Database(debug=False)
+            for name, plan in query_plans(db.conn).items():
+                print(f"{name}: {'; '.join(plan)}")
+            db.close()
+            sys.exit()
 
-            print("Database entries exported to CSV!")
+        if "--batch" in opts:
+            path = flag_argument("--batch")
+
+            db = Database(debug=False)
+            try:
+                if path:
+                    with open(path) as file:
+                        result = run_batch(db, file)
+                else:
+                    result = run_batch(db, sys.stdin)
+            except BatchError as error:
+                sys.exit(f"Batch aborted, no changes were made.\n{error}")
+            finally:
+                db.close()
+
+            print(format_result(result))
+            sys.exit()
+
+        if "--serve" in opts:
+            port = flag_argument("--serve")
+            db = Database(debug=False)
+            serve(db, port=int(port) if port else 8000)
+            db.close()
             sys.exit()
 
         if "-d" in opts or "--debug" in opts:
@@ -79,6 +218,40 @@ def cmd_line_arg_handler() -> dict:
     return cmd_line_args
 
 
+class Navigation(Exception):
+    """Raised to move the application to another page.
+
+    Raising unwinds the stack back to Application.run, which then
+    dispatches to the destination, so page changes never nest calls.
+    """
+
+    def __init__(
+        self,
+        destination: str = "main menu",
+        utility: str = "",
+        display: bool = True,
+    ) -> None:
+        """Store the page to move to and when the move was requested."""
+
+        super().__init__(destination)
+        self.destination = destination
+        self.utility = utility
+        self.display = display
+        self.requested = perf_counter()
+
+
+def flag_argument(*flags: str) -> Optional[str]:
+    """Return the command line argument following the first given flag."""
+
+    for flag in flags:
+        if flag in sys.argv:
+            index = sys.argv.index(flag) + 1
+            if index < len(sys.argv) and not sys.argv[index].startswith("-"):
+                return sys.argv[index]
+            return None
+    return None
+
+
 def input_handler(
     app: TypeAlias = "Application",
     prompt: str = "",
@@ -103,7 +276,7 @@ def input_handler(
 
     match intent:
         case "main" | "back":
-            app.main_menu()
+            raise Navigation()
         case "quit":
             app.quit_program()
 
@@ -154,17 +327,11 @@ def redirect(
 
     utility = kwargs.get("utility", "")
     if not utility:
-        app.main_menu()
-
-    match destination:
-        case "bill payment":
-            app.pay_bill(utility)
-        case "bill addition":
-            app.add_bill(utility)
-        case "bill removal":
-            app.remove_bill(utility)
-        case "utility menu":
-            app.utility_menu(utility, display=kwargs.get("display"))
+        raise Navigation()
+
+    raise Navigation(
+        destination, utility=utility, display=kwargs.get("display", True)
+    )
 
 def formatted_today() -> str:
     """Return a formatted version of today's date."""
@@ -0,0 +1,106 @@
+"""
+Load test for the local HTTP server.
+
+Run "python load_test.py [requests] [clients]" to serve a generated
+database from a temporary file on a free port and hit its read
+endpoints from several client threads, each reusing one keep-alive
+connection.
+Prints requests per second and latency percentiles with and without
+ETag revalidation.
+"""
+
+import os
+import sys
+import tempfile
+from http.client import HTTPConnection
+from itertools import cycle
+from threading import Thread
+from time import perf_counter
+
+from fixtures import seeded_database
+from server import UtilitiesServer
+
+PATHS = (
+    "/balances",
+    "/utilities",
+    "/utilities/gas/bills?limit=50",
+    "/bills/1",
+    "/payments?bill_id=1",
+)
+
+
+def client(
+    port: int, count: int, revalidate: bool, latencies: list[float]
+) -> None:
+    """Send count requests over one connection, recording latencies."""
+
+    conn = HTTPConnection("127.0.0.1", port)
+    etags: dict[str, str] = {}
+    for path in [path for path, _ in zip(cycle(PATHS), range(count))]:
+        headers = {}
+        if revalidate and path in etags:
+            headers["If-None-Match"] = etags[path]
+
+        start = perf_counter()
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(perf_counter() - start)
+
+        etag = response.getheader("ETag")
+        if etag:
+            etags[path] = etag
+    conn.close()
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Return the value below which the given fraction of values fall."""
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(requests: int, clients: int, revalidate: bool, port: int) -> None:
+    """Run one load test and print its results."""
+
+    latencies: list[float] = []
+    threads = [
+        Thread(
+            target=client,
+            args=(port, requests // clients, revalidate, latencies),
+        )
+        for _ in range(clients)
+    ]
+
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+
+    print(
+        f"{'with' if revalidate else 'without'} ETags: "
+        f"{len(latencies) / elapsed:.0f} requests/sec, "
+        f"p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    # A file database, so that requests are served from the reader pool
+    with tempfile.TemporaryDirectory() as directory:
+        db = seeded_database(10000, path=os.path.join(directory, "load.db"))
+        server = UtilitiesServer(db, port=0)
+        Thread(target=server.serve_forever, daemon=True).start()
+
+        print(f"{requests} requests from {clients} clients")
+        run(requests, clients, revalidate=False, port=server.server_port)
+        run(requests, clients, revalidate=True, port=server.server_port)
+
+        server.shutdown()
+        server.server_close()
+        db.close()
@@ -1,3 +1,5 @@
+from database import UTILITY_ADDED, UTILITY_REMOVED
+
 if False:
     # For forward-reference type-checking:
     from UtilityCalculator import Application, Database
@@ -38,7 +40,8 @@ class Menu:
         }
 
         # Main menu options are updated to include utility names
-        # by 'update_main_options' method below.
+        # by 'update_main_options' method below on startup,
+        # then by 'on_utility_event' as utilities come and go.
 
         self._orig_main_menu_len = len(self.main_options)
         # Used for formatting the division between above options and utilities
@@ -64,42 +67,61 @@ class Menu:
                 "description": "Remove a bill.",
                 "name": "'Remove Bill'",
             },
+            "next": {
+                "func": app.next_page,
+                "description": "Show the next page of bills.",
+                "name": "'Next'",
+            },
+            "previous": {
+                "func": app.previous_page,
+                "description": "Show the previous page of bills.",
+                "name": "'Previous'",
+            },
         }
 
-    def update_main_options(self) -> None:
-        """Reconcile main menu options with utilities present in database."""
-
-        def add_new_utils() -> None:
-            """Add new utilities to main menu options."""
-
-            for utility in self.app.utilities():
-
-                if utility not in self.main_options.keys():
+        self.update_main_options()
+        db.subscribe(self.on_utility_event)
 
-                    self.main_options[utility] = {
-                        "func": self.app.utility_menu,
-                        "arg": utility,
-                        "name": f'"{utility[0].upper() + utility[1:]}"',
-                        "description": f"Access your {utility} record.",
-                    }
-
-        def remove_utils() -> None:
-            """Remove utilities which have been removed from the database."""
-
-            for option in main_menu_shortlist:
-                if option not in utilities_shortlist:
-                    self.main_options.pop(option)
-
-        main_menu_shortlist = list(self.main_options)[
-            self._orig_main_menu_len :
-        ]
-
-        utilities_shortlist = [tpl[0] for tpl in self.db.get_utilities()]
-
-        if len(utilities_shortlist) > len(main_menu_shortlist):
-            add_new_utils()
-        elif len(utilities_shortlist) < len(main_menu_shortlist):
-            remove_utils()
+    def update_main_options(self) -> None:
+        """Reconcile main menu options with utilities present in database.
+
+        This is only needed on startup.  Afterwards the options are kept
+        current by on_utility_event.
+        """
+
+        utilities = self.app.utilities()
+        present = set(utilities)
+        for option in list(self.main_options)[self._orig_main_menu_len :]:
+            if option not in present:
+                self.remove_utility_option(option)
+        for utility in utilities:
+            self.add_utility_option(utility)
+
+    def on_utility_event(self, event: str, utility: str) -> None:
+        """Add or remove a utility's option when the database changes."""
+
+        if event == UTILITY_ADDED:
+            self.add_utility_option(utility)
+        elif event == UTILITY_REMOVED:
+            self.remove_utility_option(utility)
+
+    def add_utility_option(self, utility: str) -> None:
+        """Add a main menu option for a utility if it has none."""
+
+        if utility not in self.main_options:
+            self.main_options[utility] = {
+                "func": self.app.utility_menu,
+                "arg": utility,
+                "name": f'"{utility[0].upper() + utility[1:]}"',
+                "description": f"Access your {utility} record.",
+            }
+
+    def remove_utility_option(self, utility: str) -> None:
+        """Remove a utility's main menu option."""
+
+        option = self.main_options.get(utility, {})
+        if option.get("func") == self.app.utility_menu:
+            del self.main_options[utility]
 
     def print_main_menu(self) -> None:
         """Insert spacer and print out main menu options."""
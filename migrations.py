@@ -0,0 +1,913 @@
+"""
+Schema migrations for records.db.
+
+The schema version is stored in the database header with
+PRAGMA user_version.  Each function in MIGRATIONS upgrades the schema
+by one version and runs in its own transaction, so an existing
+records.db is brought up to date on startup without losing data.
+"""
+
+import re
+import sqlite3
+from datetime import datetime
+from typing import Callable
+
+from bill import parse_periods
+
+
+def add_balances_summary(c: sqlite3.Cursor) -> None:
+    """Create the balances summary table and the triggers maintaining it.
+
+    The table holds a single row with the unpaid amount for each user,
+    kept current by triggers on every write to bills.
+    """
+
+    c.execute(
+        """
+            CREATE TABLE IF NOT EXISTS balances (
+            id integer primary key check (id = 1),
+            user1_owed integer not null default 0,
+            user2_owed integer not null default 0
+            )"""
+    )
+    c.execute("INSERT OR IGNORE INTO balances (id) VALUES (1)")
+
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS balances_after_insert
+        AFTER INSERT ON bills
+        BEGIN
+            UPDATE balances SET
+            user1_owed = user1_owed
+                + (CASE WHEN NEW.user1_paid = 0
+                   THEN NEW.amount ELSE 0 END),
+            user2_owed = user2_owed
+                + (CASE WHEN NEW.user2_paid = 0
+                   THEN NEW.amount ELSE 0 END)
+            WHERE id = 1;
+        END
+        """
+    )
+
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS balances_after_delete
+        AFTER DELETE ON bills
+        BEGIN
+            UPDATE balances SET
+            user1_owed = user1_owed
+                - (CASE WHEN OLD.user1_paid = 0
+                   THEN OLD.amount ELSE 0 END),
+            user2_owed = user2_owed
+                - (CASE WHEN OLD.user2_paid = 0
+                   THEN OLD.amount ELSE 0 END)
+            WHERE id = 1;
+        END
+        """
+    )
+
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS balances_after_update
+        AFTER UPDATE OF amount, user1_paid, user2_paid ON bills
+        BEGIN
+            UPDATE balances SET
+            user1_owed = user1_owed
+                - (CASE WHEN OLD.user1_paid = 0
+                   THEN OLD.amount ELSE 0 END)
+                + (CASE WHEN NEW.user1_paid = 0
+                   THEN NEW.amount ELSE 0 END),
+            user2_owed = user2_owed
+                - (CASE WHEN OLD.user2_paid = 0
+                   THEN OLD.amount ELSE 0 END)
+                + (CASE WHEN NEW.user2_paid = 0
+                   THEN NEW.amount ELSE 0 END)
+            WHERE id = 1;
+        END
+        """
+    )
+
+    c.execute(
+        """
+        UPDATE balances SET
+        user1_owed = (SELECT TOTAL(amount) FROM bills WHERE user1_paid = 0),
+        user2_owed = (SELECT TOTAL(amount) FROM bills WHERE user2_paid = 0)
+        WHERE id = 1
+        """
+    )
+
+
+def add_bill_indexes(c: sqlite3.Cursor) -> None:
+    """Index bills by utility and by payment status.
+
+    The payment status indexes are partial, covering only unpaid rows,
+    since those are the ones the application looks up.
+    """
+
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS bills_utility ON bills (utility, id)"
+    )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS bills_unpaid ON bills (id) WHERE paid = 0"
+    )
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS bills_user1_unpaid
+        ON bills (id) WHERE user1_paid = 0
+        """
+    )
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS bills_user2_unpaid
+        ON bills (id) WHERE user2_paid = 0
+        """
+    )
+
+
+def add_payments_ledger(c: sqlite3.Cursor) -> None:
+    """Record payments in their own table instead of in bill notes.
+
+    Payment sentences previously appended to notes are parsed into
+    ledger rows and removed from the notes.
+    """
+
+    c.execute(
+        """
+            CREATE TABLE IF NOT EXISTS payments (
+            id integer primary key,
+            bill_id integer not null references bills (id),
+            user_id integer not null references users (id),
+            amount real not null,
+            paid_at text not null
+            )"""
+    )
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS payments_bill
+        ON payments (bill_id, paid_at)
+        """
+    )
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS payments_user
+        ON payments (user_id, paid_at)
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS payments_after_bill_delete
+        AFTER DELETE ON bills
+        BEGIN
+            DELETE FROM payments WHERE bill_id = OLD.id;
+        END
+        """
+    )
+
+    c.execute("SELECT name, id FROM users")
+    user_ids = dict(c.fetchall())
+
+    c.execute(
+        """
+        SELECT id, note FROM bills
+        WHERE note LIKE '%paid % for bill (ID %'
+        """
+    )
+    for bill_id, note in c.fetchall():
+        payments = []
+        remaining_note = note
+        for match in PAYMENT_NOTE.finditer(note):
+            user_id = user_ids.get(match["user"])
+            if user_id is None or int(match["id"]) != bill_id:
+                continue
+
+            try:
+                paid_at = datetime.strptime(
+                    match["date"], "%B %d, %Y at %I:%M %p"
+                ).isoformat(sep=" ", timespec="seconds")
+            except ValueError:
+                paid_at = match["date"]
+
+            payments.append(
+                (bill_id, user_id, float(match["amount"]), paid_at)
+            )
+            remaining_note = remaining_note.replace(match[0], "", 1)
+
+        if payments:
+            c.executemany(
+                """
+                INSERT INTO payments (bill_id, user_id, amount, paid_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                payments,
+            )
+            c.execute(
+                "UPDATE bills SET note = ? WHERE id = ?",
+                (remaining_note, bill_id),
+            )
+
+
+def add_bill_periods(c: sqlite3.Cursor) -> None:
+    """Store the months each bill covers as indexed YYYYMM integers.
+
+    A bill covering several months has one row per month, weighted so
+    that the weights of a bill add up to one.
+    """
+
+    c.execute(
+        """
+            CREATE TABLE IF NOT EXISTS bill_periods (
+            period integer not null,
+            bill_id integer not null references bills (id),
+            weight real not null,
+            primary key (period, bill_id)
+            ) WITHOUT ROWID"""
+    )
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS bill_periods_bill
+        ON bill_periods (bill_id)
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS bill_periods_after_bill_delete
+        AFTER DELETE ON bills
+        BEGIN
+            DELETE FROM bill_periods WHERE bill_id = OLD.id;
+        END
+        """
+    )
+    c.execute("DELETE FROM bill_periods")
+    index_periods(c)
+
+
+def add_bill_shares(c: sqlite3.Cursor) -> None:
+    """Split bills into weighted shares, one per participating user.
+
+    Existing bills get equal shares for users 1 and 2, and triggers keep
+    those two shares in step with the user1_paid and user2_paid columns
+    in both directions.  Paying a share also recomputes the bill's paid
+    flag, so a bill is only paid once every share is.
+    """
+
+    c.execute(
+        """
+            CREATE TABLE IF NOT EXISTS bill_shares (
+            bill_id integer not null references bills (id),
+            user_id integer not null references users (id),
+            weight real not null default 1 check (weight > 0),
+            paid integer not null default 0,
+            primary key (bill_id, user_id)
+            ) WITHOUT ROWID"""
+    )
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS bill_shares_user
+        ON bill_shares (user_id, paid)
+        """
+    )
+
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS bill_shares_after_bill_insert
+        AFTER INSERT ON bills
+        BEGIN
+            INSERT INTO bill_shares (bill_id, user_id, paid)
+            VALUES
+            (NEW.id, 1, IFNULL(NEW.user1_paid, 0)),
+            (NEW.id, 2, IFNULL(NEW.user2_paid, 0));
+        END
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS bill_shares_after_bill_update
+        AFTER UPDATE OF user1_paid, user2_paid ON bills
+        BEGIN
+            UPDATE bill_shares SET paid = IFNULL(NEW.user1_paid, 0)
+            WHERE bill_id = NEW.id AND user_id = 1
+            AND paid != IFNULL(NEW.user1_paid, 0);
+            UPDATE bill_shares SET paid = IFNULL(NEW.user2_paid, 0)
+            WHERE bill_id = NEW.id AND user_id = 2
+            AND paid != IFNULL(NEW.user2_paid, 0);
+        END
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS bill_shares_after_bill_delete
+        AFTER DELETE ON bills
+        BEGIN
+            DELETE FROM bill_shares WHERE bill_id = OLD.id;
+        END
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS bills_after_share_update
+        AFTER UPDATE OF paid ON bill_shares
+        BEGIN
+            UPDATE bills SET user1_paid = NEW.paid
+            WHERE id = NEW.bill_id AND NEW.user_id = 1
+            AND user1_paid IS NOT NEW.paid;
+            UPDATE bills SET user2_paid = NEW.paid
+            WHERE id = NEW.bill_id AND NEW.user_id = 2
+            AND user2_paid IS NOT NEW.paid;
+            UPDATE bills SET paid = NOT EXISTS (
+                SELECT 1 FROM bill_shares
+                WHERE bill_id = NEW.bill_id AND paid = 0
+            )
+            WHERE id = NEW.bill_id;
+        END
+        """
+    )
+
+    c.execute("DELETE FROM bill_shares")
+    c.execute(
+        """
+        INSERT INTO bill_shares (bill_id, user_id, paid)
+        SELECT id, 1, IFNULL(user1_paid, 0) FROM bills
+        UNION ALL
+        SELECT id, 2, IFNULL(user2_paid, 0) FROM bills
+        """
+    )
+
+
+def add_utilities_table(c: sqlite3.Cursor) -> None:
+    """Keep utilities in their own table, referenced by id from bills.
+
+    Each utility holds its number of bills and the total amount of its
+    unpaid bills, kept current by triggers, so utilities can be listed
+    with their statistics without reading bills.  The utility column of
+    bills is kept, and bills written with only a utility name are given
+    their utility_id by a trigger, creating the utility if needed.
+    Removing the last bill of a utility leaves the utility in place.
+    """
+
+    c.execute(
+        """
+            CREATE TABLE IF NOT EXISTS utilities (
+            id integer primary key,
+            name text not null unique,
+            bill_count integer not null default 0,
+            unpaid_total integer not null default 0
+            )"""
+    )
+    c.execute(
+        "ALTER TABLE bills ADD COLUMN utility_id integer "
+        "references utilities (id)"
+    )
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS bills_utility_id
+        ON bills (utility_id, id)
+        """
+    )
+
+    c.execute(
+        """
+        INSERT OR IGNORE INTO utilities (name)
+        SELECT DISTINCT utility FROM bills
+        WHERE utility IS NOT NULL ORDER BY utility
+        """
+    )
+    c.execute(
+        """
+        UPDATE bills SET utility_id = (
+            SELECT id FROM utilities WHERE name = bills.utility
+        )
+        """
+    )
+    c.execute(REBUILD_UTILITIES)
+
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS utilities_after_bill_insert
+        AFTER INSERT ON bills
+        BEGIN
+            INSERT OR IGNORE INTO utilities (name)
+            SELECT NEW.utility WHERE NEW.utility_id IS NULL;
+            UPDATE bills SET utility_id = (
+                SELECT id FROM utilities WHERE name = NEW.utility
+            )
+            WHERE NEW.utility_id IS NULL AND id = NEW.id;
+            UPDATE utilities SET
+            bill_count = bill_count + 1,
+            unpaid_total = unpaid_total
+                + (CASE WHEN NEW.paid = 0
+                   THEN IFNULL(NEW.amount, 0) ELSE 0 END)
+            WHERE name = NEW.utility;
+        END
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS utilities_after_bill_delete
+        AFTER DELETE ON bills
+        BEGIN
+            UPDATE utilities SET
+            bill_count = bill_count - 1,
+            unpaid_total = unpaid_total
+                - (CASE WHEN OLD.paid = 0
+                   THEN IFNULL(OLD.amount, 0) ELSE 0 END)
+            WHERE id = OLD.utility_id;
+        END
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS utilities_after_bill_update
+        AFTER UPDATE OF amount, paid ON bills
+        WHEN NEW.utility IS OLD.utility
+        BEGIN
+            UPDATE utilities SET
+            unpaid_total = unpaid_total
+                - (CASE WHEN OLD.paid = 0
+                   THEN IFNULL(OLD.amount, 0) ELSE 0 END)
+                + (CASE WHEN NEW.paid = 0
+                   THEN IFNULL(NEW.amount, 0) ELSE 0 END)
+            WHERE id = NEW.utility_id;
+        END
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS utilities_after_bill_move
+        AFTER UPDATE OF utility ON bills
+        WHEN NEW.utility IS NOT OLD.utility
+        BEGIN
+            UPDATE utilities SET
+            bill_count = bill_count - 1,
+            unpaid_total = unpaid_total
+                - (CASE WHEN OLD.paid = 0
+                   THEN IFNULL(OLD.amount, 0) ELSE 0 END)
+            WHERE id = OLD.utility_id;
+            INSERT OR IGNORE INTO utilities (name) VALUES (NEW.utility);
+            UPDATE bills SET utility_id = (
+                SELECT id FROM utilities WHERE name = NEW.utility
+            )
+            WHERE id = NEW.id;
+            UPDATE utilities SET
+            bill_count = bill_count + 1,
+            unpaid_total = unpaid_total
+                + (CASE WHEN NEW.paid = 0
+                   THEN IFNULL(NEW.amount, 0) ELSE 0 END)
+            WHERE name = NEW.utility;
+        END
+        """
+    )
+
+
+def add_bill_splits(c: sqlite3.Cursor) -> None:
+    """Weigh the two-user balances by bill shares instead of halving bills.
+
+    Bills hold the fractions of their amount which fall to users 1 and 2,
+    kept current by triggers on bill_shares, and the balances summary
+    now holds those parts of each unpaid bill instead of whole amounts.
+    Bills split evenly between users 1 and 2 keep the default of one
+    half each, so adding a bill does not need to compute its split.
+    """
+
+    for column in ("user1_share", "user2_share"):
+        c.execute(
+            f"ALTER TABLE bills ADD COLUMN {column} real not null default 0.5"
+        )
+    c.execute(SPLIT_BILLS)
+
+    c.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS bills_split_after_share_insert
+        AFTER INSERT ON bill_shares
+        WHEN NEW.user_id > 2 OR NEW.weight != 1 OR (
+            SELECT user1_share != 0.5 OR user2_share != 0.5
+            FROM bills WHERE id = NEW.bill_id
+        )
+        BEGIN
+            {SPLIT_BILLS} WHERE id = NEW.bill_id;
+        END
+        """
+    )
+    c.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS bills_split_after_share_update
+        AFTER UPDATE OF weight ON bill_shares
+        WHEN NEW.weight != OLD.weight
+        BEGIN
+            {SPLIT_BILLS} WHERE id = NEW.bill_id;
+        END
+        """
+    )
+    c.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS bills_split_after_share_delete
+        AFTER DELETE ON bill_shares
+        BEGIN
+            {SPLIT_BILLS} WHERE id = OLD.bill_id;
+        END
+        """
+    )
+
+    for trigger in ("insert", "delete", "update"):
+        c.execute(f"DROP TRIGGER IF EXISTS balances_after_{trigger}")
+    c.execute(
+        """
+        CREATE TRIGGER balances_after_insert
+        AFTER INSERT ON bills
+        BEGIN
+            UPDATE balances SET
+            user1_owed = user1_owed
+                + (CASE WHEN NEW.user1_paid = 0
+                   THEN IFNULL(NEW.amount, 0) * NEW.user1_share ELSE 0 END),
+            user2_owed = user2_owed
+                + (CASE WHEN NEW.user2_paid = 0
+                   THEN IFNULL(NEW.amount, 0) * NEW.user2_share ELSE 0 END)
+            WHERE id = 1;
+        END
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER balances_after_delete
+        AFTER DELETE ON bills
+        BEGIN
+            UPDATE balances SET
+            user1_owed = user1_owed
+                - (CASE WHEN OLD.user1_paid = 0
+                   THEN IFNULL(OLD.amount, 0) * OLD.user1_share ELSE 0 END),
+            user2_owed = user2_owed
+                - (CASE WHEN OLD.user2_paid = 0
+                   THEN IFNULL(OLD.amount, 0) * OLD.user2_share ELSE 0 END)
+            WHERE id = 1;
+        END
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER balances_after_update
+        AFTER UPDATE OF amount, user1_paid, user2_paid, user1_share,
+        user2_share ON bills
+        BEGIN
+            UPDATE balances SET
+            user1_owed = user1_owed
+                - (CASE WHEN OLD.user1_paid = 0
+                   THEN IFNULL(OLD.amount, 0) * OLD.user1_share ELSE 0 END)
+                + (CASE WHEN NEW.user1_paid = 0
+                   THEN IFNULL(NEW.amount, 0) * NEW.user1_share ELSE 0 END),
+            user2_owed = user2_owed
+                - (CASE WHEN OLD.user2_paid = 0
+                   THEN IFNULL(OLD.amount, 0) * OLD.user2_share ELSE 0 END)
+                + (CASE WHEN NEW.user2_paid = 0
+                   THEN IFNULL(NEW.amount, 0) * NEW.user2_share ELSE 0 END)
+            WHERE id = 1;
+        END
+        """
+    )
+    c.execute(REBUILD_BALANCES)
+
+
+def normalize_paid_flags(c: sqlite3.Cursor) -> None:
+    """Store missing paid flags as unpaid.
+
+    Bills written by other programs may leave user1_paid, user2_paid or
+    paid NULL, which bill_shares counted as unpaid while the balances,
+    the utility totals and queries on the flags counted it as paid.
+    Existing NULL flags are rewritten, and triggers rewrite any written
+    later, so every reader sees 0 or 1.  A missing paid flag is worked
+    out from the other flags and the bill's shares.
+    """
+
+    # The bill may not be linked to its utility yet, so link it here
+    # before rewriting the flags the utility totals are kept from
+    c.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS bills_normalize_after_insert
+        AFTER INSERT ON bills
+        WHEN NEW.user1_paid IS NULL OR NEW.user2_paid IS NULL
+        OR NEW.paid IS NULL
+        BEGIN
+            INSERT OR IGNORE INTO utilities (name)
+            SELECT NEW.utility WHERE NEW.utility_id IS NULL;
+            UPDATE bills SET utility_id = (
+                SELECT id FROM utilities WHERE name = NEW.utility
+            )
+            WHERE NEW.utility_id IS NULL AND id = NEW.id;
+            {NORMALIZE_PAID} WHERE id = NEW.id;
+        END
+        """
+    )
+    c.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS bills_normalize_after_update
+        AFTER UPDATE OF user1_paid, user2_paid, paid ON bills
+        WHEN NEW.user1_paid IS NULL OR NEW.user2_paid IS NULL
+        OR NEW.paid IS NULL
+        BEGIN
+            {NORMALIZE_PAID} WHERE id = NEW.id;
+        END
+        """
+    )
+    c.execute(
+        f"""
+        {NORMALIZE_PAID}
+        WHERE user1_paid IS NULL OR user2_paid IS NULL OR paid IS NULL
+        """
+    )
+
+
+def add_change_version(c: sqlite3.Cursor) -> None:
+    """Count writes in a version number stored in the database.
+
+    Triggers bump the version on every write to the tables the
+    application reads, whichever connection or process makes it.  Each
+    database also gets a random epoch, so versions of different database
+    files are never mistaken for one another.
+    """
+
+    c.execute(
+        """
+            CREATE TABLE IF NOT EXISTS changes (
+            id integer primary key check (id = 1),
+            epoch text not null,
+            version integer not null default 0
+            )"""
+    )
+    c.execute(
+        """
+        INSERT OR IGNORE INTO changes (id, epoch)
+        VALUES (1, lower(hex(randomblob(8))))
+        """
+    )
+
+    for table, events in CHANGE_EVENTS.items():
+        for event in events:
+            c.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS
+                changes_after_{table}_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE changes SET version = version + 1 WHERE id = 1;
+                END
+                """
+            )
+
+
+def drop_utility_text_index(c: sqlite3.Cursor) -> None:
+    """Drop the index on the utility names stored in bills.
+
+    Bills of a utility are looked up by utility_id instead, using
+    bills_utility_id.
+    """
+
+    c.execute("DROP INDEX IF EXISTS bills_utility")
+
+
+def sync_flags_on_share_insert(c: sqlite3.Cursor) -> None:
+    """Copy the paid flag of a newly added share onto its bill.
+
+    A user who joins a bill, or rejoins it after being left out, takes
+    on the paid flag of their new share instead of the one left behind
+    on the bill, and an unpaid share makes the whole bill unpaid.
+    """
+
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS bills_after_share_insert
+        AFTER INSERT ON bill_shares
+        WHEN NEW.user_id <= 2 OR NEW.paid = 0
+        BEGIN
+            UPDATE bills SET user1_paid = NEW.paid
+            WHERE id = NEW.bill_id AND NEW.user_id = 1
+            AND user1_paid IS NOT NEW.paid;
+            UPDATE bills SET user2_paid = NEW.paid
+            WHERE id = NEW.bill_id AND NEW.user_id = 2
+            AND user2_paid IS NOT NEW.paid;
+            UPDATE bills SET paid = 0
+            WHERE id = NEW.bill_id AND NEW.paid = 0 AND paid != 0;
+        END
+        """
+    )
+
+
+def index_periods_by_trigger(c: sqlite3.Cursor) -> None:
+    """Keep bill_periods current with triggers instead of Python code.
+
+    Bills inserted or redated by any client are indexed, splitting their
+    dates in SQL and skipping the same parts as parse_periods.  Dates of
+    a single month, the usual case, are handled by a faster trigger.
+    """
+
+    c.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS bill_periods_after_month_insert
+        AFTER INSERT ON bills
+        WHEN {SINGLE_MONTH}
+        BEGIN
+            INSERT INTO bill_periods (period, bill_id, weight)
+            SELECT
+            (2000 + substr(NEW.date, 4)) * 100 + substr(NEW.date, 1, 2),
+            NEW.id,
+            1
+            WHERE substr(NEW.date, 1, 2) BETWEEN '01' AND '12';
+        END
+        """
+    )
+    c.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS bill_periods_after_bill_insert
+        AFTER INSERT ON bills
+        WHEN NOT {SINGLE_MONTH}
+        BEGIN
+            {INDEX_NEW_PERIODS};
+        END
+        """
+    )
+    c.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS bill_periods_after_date_update
+        AFTER UPDATE OF date ON bills
+        WHEN NEW.date IS NOT OLD.date
+        BEGIN
+            DELETE FROM bill_periods WHERE bill_id = NEW.id;
+            {INDEX_NEW_PERIODS};
+        END
+        """
+    )
+    c.execute("DELETE FROM bill_periods")
+    index_periods(c)
+
+
+def index_periods(c: sqlite3.Cursor, after_id: int = 0) -> None:
+    """Add bill_periods rows for every bill with an id above after_id."""
+
+    c.execute(
+        "SELECT id, date FROM bills WHERE id > ? ORDER BY id", (after_id,)
+    )
+    rows = []
+    for bill_id, date in c.fetchall():
+        periods = set(parse_periods(date or ""))
+        rows.extend((period, bill_id, 1 / len(periods)) for period in periods)
+
+    c.executemany(
+        "INSERT OR IGNORE INTO bill_periods VALUES (?, ?, ?)", rows
+    )
+
+
+# Dates of one month such as '03-17', which need no splitting
+SINGLE_MONTH = "NEW.date GLOB '[0-9][0-9]-[0-9][0-9]'"
+
+# Adds the bill_periods rows of the bill NEW, parsing its date like
+# parse_periods.  The date is split into parts by making it a JSON array.
+INDEX_NEW_PERIODS = """
+    INSERT INTO bill_periods (period, bill_id, weight)
+    SELECT period, NEW.id, 1.0 / COUNT(*) OVER () FROM (
+        SELECT DISTINCT
+        (2000 + CAST(substr(part, instr(part, '-') + 1) AS INTEGER)) * 100
+        + CAST(substr(part, 1, instr(part, '-') - 1) AS INTEGER) AS period
+        FROM (
+            SELECT trim(value, ' ' || char(9, 10, 11, 12, 13)) AS part
+            FROM json_each(
+                '[' || replace(json_quote(NEW.date), ',', '","') || ']'
+            )
+        )
+        WHERE instr(part, '-') > 1
+        AND substr(part, 1, instr(part, '-') - 1) NOT GLOB '*[^0-9]*'
+        AND substr(part, instr(part, '-') + 1) GLOB '[0-9][0-9]'
+        AND CAST(substr(part, 1, instr(part, '-') - 1) AS INTEGER)
+            BETWEEN 1 AND 12
+    )
+    """
+
+PAYMENT_NOTE = re.compile(
+    r"\n(?P<user>.+?) paid (?P<amount>[\d.]+) "
+    r"for bill \(ID (?P<id>\d+)\) on (?P<date>.+?), "
+    r"paying off their portion of the bill\."
+)
+
+REBUILD_BALANCES = """
+    UPDATE balances SET
+    user1_owed = (
+        SELECT TOTAL(amount * user1_share) FROM bills WHERE user1_paid = 0
+    ),
+    user2_owed = (
+        SELECT TOTAL(amount * user2_share) FROM bills WHERE user2_paid = 0
+    )
+    WHERE id = 1
+    """
+
+# Fractions of each bill's amount falling to users 1 and 2, by weight
+SPLIT_BILLS = """
+    UPDATE bills SET
+    user1_share = IFNULL((
+        SELECT weight FROM bill_shares WHERE bill_id = bills.id AND user_id = 1
+    ) / (SELECT SUM(weight) FROM bill_shares WHERE bill_id = bills.id), 0),
+    user2_share = IFNULL((
+        SELECT weight FROM bill_shares WHERE bill_id = bills.id AND user_id = 2
+    ) / (SELECT SUM(weight) FROM bill_shares WHERE bill_id = bills.id), 0)
+    """
+
+REBUILD_UTILITIES = """
+    UPDATE utilities SET
+    bill_count = (
+        SELECT COUNT(*) FROM bills WHERE utility_id = utilities.id
+    ),
+    unpaid_total = (
+        SELECT IFNULL(SUM(amount), 0) FROM bills
+        WHERE utility_id = utilities.id AND paid = 0
+    )
+    """
+
+# Rewrites NULL paid flags of bills as unpaid
+NORMALIZE_PAID = """
+    UPDATE bills SET
+    user1_paid = IFNULL(user1_paid, 0),
+    user2_paid = IFNULL(user2_paid, 0),
+    paid = IFNULL(
+        paid,
+        IFNULL(user1_paid, 0) AND IFNULL(user2_paid, 0) AND NOT EXISTS (
+            SELECT 1 FROM bill_shares WHERE bill_id = bills.id AND paid = 0
+        )
+    )
+    """
+
+# Writes which bump the version in the changes table.  Changes to the
+# utility totals always come with a write to bills, so only utilities
+# being added or removed are counted.
+CHANGE_EVENTS = {
+    "bills": ("INSERT", "UPDATE", "DELETE"),
+    "bill_shares": ("INSERT", "UPDATE", "DELETE"),
+    "payments": ("INSERT", "UPDATE", "DELETE"),
+    "users": ("INSERT", "UPDATE", "DELETE"),
+    "utilities": ("INSERT", "DELETE"),
+}
+
+MIGRATIONS: list[Callable[[sqlite3.Cursor], None]] = [
+    add_balances_summary,
+    add_bill_indexes,
+    add_payments_ledger,
+    add_bill_periods,
+    add_bill_shares,
+    add_utilities_table,
+    add_bill_splits,
+    normalize_paid_flags,
+    add_change_version,
+    drop_utility_text_index,
+    sync_flags_on_share_insert,
+    index_periods_by_trigger,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Queries which would scan the whole bills table without an index.
+INDEXED_QUERIES = {
+    "get_utility_record": """
+        SELECT * FROM bills WHERE utility_id = (
+            SELECT id FROM utilities WHERE name = 'gas'
+        )
+        """,
+    "get_utilities": "SELECT name FROM utilities ORDER BY name",
+    "get_unpaid_bills": "SELECT * FROM bills WHERE paid = 0",
+    "get_bills_owed": """
+        SELECT * FROM bills WHERE id IN (
+            SELECT bill_id FROM bill_shares WHERE user_id = 1 AND paid = 0
+        )
+        """,
+}
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    """Return the schema version stored in the database."""
+
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> list[int]:
+    """Apply all pending migrations and return the versions applied."""
+
+    applied = []
+    version = get_version(conn)
+
+    for migration in MIGRATIONS[version:]:
+        version += 1
+        c = conn.cursor()
+        c.execute("BEGIN")
+        try:
+            migration(c)
+            c.execute(f"PRAGMA user_version = {version}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        applied.append(version)
+
+    return applied
+
+
+def query_plans(conn: sqlite3.Connection) -> dict[str, list[str]]:
+    """Return the query plan SQLite picks for each indexed query."""
+
+    plans = {}
+    for name, query in INDEXED_QUERIES.items():
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+        plans[name] = [row[-1] for row in rows]
+    return plans
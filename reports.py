@@ -0,0 +1,175 @@
+"""
+Vectorized reports over the whole bill history.
+
+Bills are loaded once into a BillBatch and its columns are viewed as
+NumPy arrays, so totals are computed with array operations instead of
+a Python loop per bill.  This module needs NumPy, which the rest of the
+application does not, so it is only imported when a report is requested.
+"""
+
+from array import array
+from typing import NamedTuple
+
+import numpy as np
+
+from bill import BillBatch, parse_periods
+
+
+class UtilityTotals(NamedTuple):
+    """Store the totals for a single utility."""
+
+    bills: int
+    total: int
+    unpaid: int
+    unpaid_ratio: float
+
+
+class Report(NamedTuple):
+    """Store the results of a report over a batch of bills."""
+
+    utilities: dict[str, UtilityTotals]
+    user1_owed: float
+    user2_owed: float
+    months: dict[int, float]
+    running_balance: np.ndarray
+
+
+def columns(batch: BillBatch) -> dict[str, np.ndarray]:
+    """View the columns of a batch as NumPy arrays without copying."""
+
+    return {
+        "amounts": _view(batch.amounts, "i"),
+        "user1_paid": _view(batch.user1_paid, "u") != 0,
+        "user2_paid": _view(batch.user2_paid, "u") != 0,
+        "paid": _view(batch.paid, "u") != 0,
+        "user1_share": _view(batch.user1_share, "f"),
+        "user2_share": _view(batch.user2_share, "f"),
+        "utility_codes": _view(batch.utility_codes, "u"),
+        "date_codes": _view(batch.date_codes, "u"),
+    }
+
+
+def _view(values: array, kind: str) -> np.ndarray:
+    """View an array as a NumPy array of the same item size."""
+
+    return np.frombuffer(values, dtype=f"{kind}{values.itemsize}")
+
+
+def utility_totals(batch: BillBatch) -> dict[str, UtilityTotals]:
+    """Total and unpaid amounts for each utility."""
+
+    cols = columns(batch)
+    size = len(batch.utilities)
+    codes = cols["utility_codes"]
+    amounts = cols["amounts"]
+
+    counts = np.bincount(codes, minlength=size)
+    totals = np.bincount(codes, weights=amounts, minlength=size)
+    unpaid = np.bincount(
+        codes, weights=amounts * ~cols["paid"], minlength=size
+    )
+    ratios = np.divide(unpaid, totals, out=np.zeros(size), where=totals != 0)
+
+    return {
+        utility: UtilityTotals(
+            int(counts[code]),
+            int(totals[code]),
+            int(unpaid[code]),
+            float(ratios[code]),
+        )
+        for code, utility in enumerate(batch.utilities)
+    }
+
+
+def user_totals(batch: BillBatch) -> tuple[float, float]:
+    """Amounts owed by user 1 and user 2."""
+
+    cols = columns(batch)
+    amounts = cols["amounts"]
+    user1_owed = (amounts * cols["user1_share"])[~cols["user1_paid"]].sum()
+    user2_owed = (amounts * cols["user2_share"])[~cols["user2_paid"]].sum()
+    return float(user1_owed), float(user2_owed)
+
+
+def monthly_totals(batch: BillBatch) -> dict[int, float]:
+    """Amount billed for each YYYYMM month.
+
+    A bill covering several months is split evenly between them.
+    Bills whose date cannot be read are left out.
+    """
+
+    cols = columns(batch)
+    per_date = np.bincount(
+        cols["date_codes"], weights=cols["amounts"], minlength=len(batch.dates)
+    )
+
+    # Spread the total of each distinct date over the months it covers
+    date_codes = []
+    periods = []
+    weights = []
+    for code, date in enumerate(batch.dates):
+        covered = parse_periods(date)
+        for period in covered:
+            date_codes.append(code)
+            periods.append(period)
+            weights.append(1 / len(covered))
+
+    if not periods:
+        return {}
+
+    months, month_codes = np.unique(np.array(periods), return_inverse=True)
+    amounts = per_date[np.array(date_codes, dtype=np.intp)] * np.array(weights)
+    totals = np.bincount(month_codes, weights=amounts, minlength=len(months))
+    return {int(month): float(total) for month, total in zip(months, totals)}
+
+
+def running_balance(batch: BillBatch) -> np.ndarray:
+    """Net amount user 1 owes user 2 after each bill, in id order.
+
+    Negative values mean user 2 owes user 1.
+    """
+
+    cols = columns(batch)
+    amounts = cols["amounts"]
+    user1_owed = amounts * cols["user1_share"] * ~cols["user1_paid"]
+    user2_owed = amounts * cols["user2_share"] * ~cols["user2_paid"]
+    return np.cumsum(user1_owed - user2_owed)
+
+
+def build_report(batch: BillBatch) -> Report:
+    """Compute every report over a batch of bills."""
+
+    user1_owed, user2_owed = user_totals(batch)
+    return Report(
+        utility_totals(batch),
+        user1_owed,
+        user2_owed,
+        monthly_totals(batch),
+        running_balance(batch),
+    )
+
+
+def format_report(report: Report, user1: str, user2: str) -> str:
+    """Lay out a report for printing to the terminal."""
+
+    lines = ["Utilities:"]
+    for utility, totals in sorted(report.utilities.items()):
+        lines.append(
+            f"  {utility}: {totals.bills} bills, {totals.total} yen, "
+            f"{totals.unpaid} yen unpaid ({totals.unpaid_ratio:.0%})"
+        )
+
+    lines.append(f"{user1} owes {report.user1_owed} yen.")
+    lines.append(f"{user2} owes {report.user2_owed} yen.")
+
+    lines.append("Months:")
+    for month, total in sorted(report.months.items()):
+        lines.append(f"  {month % 100:02d}-{month // 100}: {round(total)} yen")
+
+    if len(report.running_balance):
+        lines.append(
+            "Largest balance in history: "
+            f"{round(np.abs(report.running_balance).max())} yen"
+        )
+
+    return "\n".join(lines)
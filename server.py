@@ -0,0 +1,250 @@
+"""
+Local HTTP server exposing the database as JSON.
+
+Endpoints:
+    GET  /utilities
+    GET  /utilities/<utility>/bills?after_id=0&limit=10
+    GET  /bills/<id>
+    GET  /balances
+    GET  /payments?user=<name>&bill_id=<id>
+    POST /bills       {"utility", "date", "amount", ...}
+    POST /payments    {"ids": [...], "user": <name>}
+
+POST /payments answers with the ids of the bills paid, the bills settled
+by the payment and the ids which could not be found.
+
+Connections are kept alive between requests, and the bill list and
+balance endpoints send an ETag so that clients can revalidate with
+If-None-Match and receive 304 Not Modified without a database query.
+"""
+
+import json
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from bill import Bill
+from bill_io import row_to_bill
+from database import PAGE_SIZE, Database
+
+MAX_PAGE_SIZE = 500
+
+
+def bill_to_json(bill: Bill) -> dict:
+    """Convert a Bill to a JSON-serializable dictionary."""
+
+    return {
+        "id": bill.id,
+        "utility": bill.utility,
+        "date": bill.date,
+        "amount": bill.amount,
+        "user1_paid": bool(bill.user1_paid),
+        "user2_paid": bool(bill.user2_paid),
+        "paid": bool(bill.paid),
+        "note": bill.note,
+    }
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Handle a single HTTP request against the server's Database."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so Nagle's algorithm
+    # would hold each response back waiting for a delayed ACK
+    disable_nagle_algorithm = True
+    server: "UtilitiesServer"
+
+    def do_GET(self) -> None:
+        self.respond(self.route_get)
+
+    def do_POST(self) -> None:
+        self.respond(self.route_post)
+
+    def respond(self, route: Callable[[list[str], dict], None]) -> None:
+        """Route the request, answering 400 if its input is invalid."""
+
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        query = {key: value[-1] for key, value in parse_qs(url.query).items()}
+        try:
+            route(parts, query)
+        except (KeyError, TypeError, ValueError) as error:
+            self.send_error_json(
+                HTTPStatus.BAD_REQUEST, f"Bad request: {error!r}"
+            )
+
+    def route_get(self, parts: list[str], query: dict) -> None:
+        """Answer a GET request."""
+
+        db = self.server.db
+
+        match parts:
+            case ["utilities"]:
+                self.send_json([row[0] for row in db.get_utilities()])
+
+            case ["utilities", utility, "bills"]:
+                etag = self.etag()
+                if self.not_modified(etag):
+                    return
+                limit = min(int(query.get("limit", PAGE_SIZE)), MAX_PAGE_SIZE)
+                page = db.get_utility_page(
+                    utility,
+                    after_id=int(query.get("after_id", 0)),
+                    limit=limit,
+                )
+                self.send_json(
+                    [bill_to_json(bill) for bill in page], etag=etag
+                )
+
+            case ["bills", bill_id]:
+                bill = db.get_record(int(bill_id))
+                if bill is None:
+                    self.send_error_json(HTTPStatus.NOT_FOUND, "No such bill.")
+                else:
+                    self.send_json(bill_to_json(bill))
+
+            case ["balances"]:
+                etag = self.etag()
+                if self.not_modified(etag):
+                    return
+                balances = db.get_balances()
+                users = db.get_users()
+                self.send_json(
+                    {
+                        "owed": {
+                            users[1]: balances.user1,
+                            users[2]: balances.user2,
+                        },
+                        "net": balances.net,
+                    },
+                    etag=etag,
+                )
+
+            case ["payments"]:
+                bill_id = query.get("bill_id")
+                user = query.get("user")
+                payments = db.get_payments(
+                    bill_id=int(bill_id) if bill_id else None,
+                    user=self.user_name(user) if user else None,
+                )
+                self.send_json([payment._asdict() for payment in payments])
+
+            case _:
+                self.send_error_json(HTTPStatus.NOT_FOUND, "No such endpoint.")
+
+    def route_post(self, parts: list[str], query: dict) -> None:
+        """Answer a POST request."""
+
+        db = self.server.db
+        body = self.read_json()
+
+        match parts:
+            case ["bills"]:
+                db.add_bill(row_to_bill(body))
+                self.send_json({}, status=HTTPStatus.CREATED)
+
+            case ["payments"]:
+                result = db.pay_bills(
+                    [int(bill_id) for bill_id in body["ids"]],
+                    self.user_name(body["user"]),
+                    utility=body.get("utility"),
+                )
+                self.send_json(result._asdict())
+
+            case _:
+                self.send_error_json(HTTPStatus.NOT_FOUND, "No such endpoint.")
+
+    def user_name(self, user: Any) -> str:
+        """Return the lowercase name of an existing user."""
+
+        name = str(user).lower()
+        users = self.server.db.get_users().values()
+        if name not in {user_name.lower() for user_name in users}:
+            raise ValueError(f"No user named {user!r}.")
+        return name
+
+    def read_json(self) -> Any:
+        """Read and decode the JSON body of the request."""
+
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def not_modified(self, etag: str) -> bool:
+        """Answer 304 if the client's ETag matches the current one."""
+
+        if self.headers.get("If-None-Match") != etag:
+            return False
+
+        self.send_response(HTTPStatus.NOT_MODIFIED)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return True
+
+    def etag(self) -> str:
+        """ETag of the current state of the database.
+
+        It is read before the data it labels, so a write landing in
+        between makes the tag older than the data, never newer.
+        """
+
+        return f'"{self.server.db.change_token()}"'
+
+    def send_json(
+        self,
+        data: Any,
+        status: HTTPStatus = HTTPStatus.OK,
+        etag: str | None = None,
+    ) -> None:
+        """Send data as a JSON response, labelled with etag if given."""
+
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: HTTPStatus, message: str) -> None:
+        """Send an error message as a JSON response."""
+
+        self.send_json({"error": message}, status=status)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UtilitiesServer(ThreadingHTTPServer):
+    """HTTP server handling each connection on its own thread."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        db: Database,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        verbose: bool = False,
+    ) -> None:
+        """Bind the server to host and port, serving from db."""
+
+        self.db = db
+        self.verbose = verbose
+        super().__init__((host, port), RequestHandler)
+
+
+def serve(db: Database, host: str = "127.0.0.1", port: int = 8000) -> None:
+    """Serve the database until interrupted."""
+
+    server = UtilitiesServer(db, host, port, verbose=True)
+    print(f"Serving on http://{host}:{server.server_port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
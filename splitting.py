@@ -0,0 +1,197 @@
+"""
+Splitting bills between any number of users.
+
+Each bill is divided into shares, one per participating user, in
+proportion to their weights.  Users who have paid their share are
+taken to have covered the shares of those who have not, so every
+unpaid share is owed to the paying users in proportion to their
+weights.  A bill nobody has paid yet creates no debts between users.
+
+Net balances are settled with a greedy plan which repeatedly matches
+the largest creditor with the largest debtor.  Each transfer clears at
+least one of the two, so N users need at most N - 1 transfers, and
+keeping both sides in heaps makes the plan O(N log N).
+
+The fewest possible transfers is N minus the largest number of groups
+the users can be split into which each settle among themselves.
+Finding those groups takes O(2^N * N) time, so the exact plan is only
+used automatically for groups of up to EXACT_LIMIT users.
+"""
+
+from collections import defaultdict
+from heapq import heapify, heappop, heappush
+from typing import Any, Iterable, NamedTuple, Sequence
+
+# Amounts smaller than this are treated as settled
+EPSILON = 1e-6
+
+# Largest number of unsettled users planned exactly by default
+EXACT_LIMIT = 14
+
+
+class Share(NamedTuple):
+    """Store one user's part in a bill."""
+
+    user: Any
+    weight: float
+    paid: bool
+
+
+class Transfer(NamedTuple):
+    """Store a payment from one user to another in a settlement."""
+
+    debtor: Any
+    creditor: Any
+    amount: float
+
+
+def net_balances(
+    bills: Iterable[tuple[float, Sequence[Share]]]
+) -> dict[Any, float]:
+    """Net amount owed to each user across bills of (amount, shares).
+
+    Positive balances are owed to the user, negative balances owed by
+    them, and the balances of all users add up to zero.
+    """
+
+    balances: defaultdict[Any, float] = defaultdict(float)
+    for amount, shares in bills:
+        total_weight = sum(share.weight for share in shares)
+        paid_weight = sum(share.weight for share in shares if share.paid)
+        if paid_weight <= 0 or paid_weight >= total_weight:
+            continue
+
+        unpaid = amount * (total_weight - paid_weight) / total_weight
+        for share in shares:
+            if share.paid:
+                balances[share.user] += unpaid * share.weight / paid_weight
+            else:
+                balances[share.user] -= amount * share.weight / total_weight
+
+    return dict(balances)
+
+
+def settle(balances: dict[Any, float]) -> list[Transfer]:
+    """Plan transfers which bring every balance to zero."""
+
+    # Both heaps pop the largest amount first
+    creditors = [
+        (-amount, user)
+        for user, amount in balances.items()
+        if amount > EPSILON
+    ]
+    debtors = [
+        (amount, user)
+        for user, amount in balances.items()
+        if amount < -EPSILON
+    ]
+    heapify(creditors)
+    heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heappop(creditors)
+        debt, debtor = heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append(Transfer(debtor, creditor, amount))
+
+        if -credit - amount > EPSILON:
+            heappush(creditors, (credit + amount, creditor))
+        if -debt - amount > EPSILON:
+            heappush(debtors, (debt + amount, debtor))
+
+    return transfers
+
+
+def settle_exactly(balances: dict[Any, float]) -> list[Transfer]:
+    """Plan the fewest transfers which bring every balance to zero.
+
+    Balances are rounded to hundredths for finding the groups which
+    settle among themselves, and each group is then settled greedily,
+    which takes one transfer fewer than the group has users.
+    """
+
+    users = [
+        user for user, amount in balances.items() if abs(amount) > EPSILON
+    ]
+    cents = [round(balances[user] * 100) for user in users]
+    if cents:
+        # Give any rounding error to the largest balance
+        largest = max(range(len(cents)), key=lambda i: abs(cents[i]))
+        cents[largest] -= sum(cents)
+
+    # groups[mask] is the most groups settling among themselves
+    # which the users in mask can be split into
+    size = len(users)
+    full = (1 << size) - 1
+    totals = [0] * (full + 1)
+    groups = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        lowest = mask & -mask
+        totals[mask] = totals[mask ^ lowest] + cents[lowest.bit_length() - 1]
+        groups[mask] = (totals[mask] == 0) + max(
+            groups[mask ^ (1 << i)] for i in range(size) if mask >> i & 1
+        )
+
+    # Retrace the users in order, settling each group as it closes
+    transfers = []
+    mask = full
+    group = []
+    while mask:
+        settled = totals[mask] == 0
+        i = next(
+            i
+            for i in range(size)
+            if mask >> i & 1
+            and groups[mask ^ (1 << i)] + settled == groups[mask]
+        )
+        group.append(users[i])
+        mask ^= 1 << i
+        if totals[mask] == 0:
+            transfers.extend(settle({user: balances[user] for user in group}))
+            group = []
+
+    return transfers
+
+
+def plan_settlement(
+    balances: dict[Any, float], exact: bool | None = None
+) -> list[Transfer]:
+    """Plan transfers which bring every balance to zero.
+
+    The plan is exact when exact is True, greedy when it is False,
+    and exact only for up to EXACT_LIMIT unsettled users when None.
+    """
+
+    if exact is None:
+        unsettled = sum(abs(amount) > EPSILON for amount in balances.values())
+        exact = unsettled <= EXACT_LIMIT
+    return settle_exactly(balances) if exact else settle(balances)
+
+
+def format_settlement(
+    balances: dict[Any, float], transfers: list[Transfer]
+) -> str:
+    """Lay out balances and a settlement plan for printing."""
+
+    lines = ["Balances:"]
+    for user, amount in sorted(balances.items(), key=lambda item: item[1]):
+        if amount < -EPSILON:
+            lines.append(f"  {user} owes {round(-amount)} yen")
+        elif amount > EPSILON:
+            lines.append(f"  {user} is owed {round(amount)} yen")
+        else:
+            lines.append(f"  {user} is settled")
+
+    if not transfers:
+        lines.append("Nobody owes anybody anything at this time.")
+        return "\n".join(lines)
+
+    count = len(transfers)
+    lines.append(f"Settle up with {count} transfer{'s' * (count != 1)}:")
+    for transfer in transfers:
+        lines.append(
+            f"  {transfer.debtor} pays {transfer.creditor} "
+            f"{round(transfer.amount)} yen"
+        )
+    return "\n".join(lines)
@@ -1,8 +1,41 @@
+import asyncio
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
 import unittest
-from random import choice, randint
+from http.client import HTTPConnection
+from unittest.mock import patch
 
-from bill import Bill
-from database import Database
+import backup
+from async_database import AsyncDatabase
+from batch import BatchError, run_batch
+from benchmarks import find_regressions, run_suite
+from bill import parse_periods
+from bill_io import read_bills, write_bills
+from database import Balances, Database
+from fixtures import generate_bill, seeded_database
+from helpers import Navigation, redirect
+from migrations import SCHEMA_VERSION, get_version, migrate, query_plans
+from server import UtilitiesServer
+from splitting import (
+    Share,
+    Transfer,
+    net_balances,
+    plan_settlement,
+    settle,
+    settle_exactly,
+)
+from utilities_calculator import Application
+
+try:
+    import numpy
+    import reports
+except ImportError:
+    numpy = None
 
 
 class TestUtilityCalculator(unittest.TestCase):
@@ -15,61 +48,19 @@ class TestUtilityCalculator(unittest.TestCase):
         cls.db.conn.close()
 
     def setUp(self):
-        self.db.c.execute(
+        with self.db.transaction() as c:
+            c.execute(
+                """
+            DELETE FROM bills
             """
-        DELETE FROM bills
-        """
-        )
+            )
+            c.execute("DELETE FROM utilities")
 
     def tearDown(self):
         pass
 
     def bill_generator(self, **kwargs):
-        if kwargs.get("utility"):
-            utility = kwargs.get("utility")
-        else:
-            utility = choice(("electric", "rent", "gas", "water"))
-
-        if kwargs.get("amount"):
-            amount = int(kwargs.get("amount"))
-        else:
-            amount = randint(2000, 10000)
-
-        if kwargs.get("date"):
-            date = kwargs.get("date")
-        else:
-            date = choice(("02-17", "03-17,04-17", "10-18", "10-20"))
-
-        if (
-            kwargs.get("user2_paid") is False
-            or kwargs.get("user2_paid") is True
-        ):
-            user2_paid = kwargs.get("user2_paid")
-        else:
-            user2_paid = choice((True, False))
-
-        if (
-            kwargs.get("user1_paid") is False
-            or kwargs.get("user1_paid") is True
-        ):
-            user1_paid = kwargs.get("user1_paid")
-        else:
-            user1_paid = choice((True, False))
-
-        if user2_paid and user1_paid:
-            paid = True
-        else:
-            paid = False
-
-        return Bill(
-            utility,
-            date,
-            amount,
-            user2_paid=user2_paid,
-            user1_paid=user1_paid,
-            paid=paid,
-            note="Test Note",
-        )
+        return generate_bill(**kwargs)
 
     def test_get_record(self):
         self.db.add_bill(self.bill_generator())
@@ -109,10 +100,9 @@ class TestUtilityCalculator(unittest.TestCase):
         self.assertEqual(self.db.get_all_records()[0].user1_paid, False)
         self.assertEqual(self.db.get_all_records()[0].paid, False)
 
-        bill.user2_paid = True
-        bill.user1_paid = True
-        bill.paid = True
-        self.db.pay_bill(bill)
+        bill_id = self.db.get_all_records()[0].id
+        self.db.pay_bills([bill_id], "testuser1")
+        self.db.pay_bills([bill_id], "testuser2")
 
         self.assertEqual(self.db.get_all_records()[0].user1_paid, True)
         self.assertEqual(self.db.get_all_records()[0].paid, True)
@@ -142,6 +132,839 @@ class TestUtilityCalculator(unittest.TestCase):
             bill.user1_paid = True
             bill.paid = True
 
+    def test_db_pay_bills(self):
+        for _ in range(3):
+            self.db.add_bill(
+                self.bill_generator(
+                    utility="gas", user1_paid=False, user2_paid=True
+                )
+            )
+        self.db.add_bill(
+            self.bill_generator(
+                utility="water", user1_paid=False, user2_paid=False
+            )
+        )
+
+        result = self.db.pay_bills([1, 2, 4, 99], "testuser1", utility="gas")
+
+        self.assertEqual(result, ([1, 2], [1, 2], [4, 99]))
+        self.assertEqual(
+            self.db.pay_bills([1, 3], "testuser1"), ([3], [3], [])
+        )
+        self.assertEqual(self.db.pay_bills([1], "testuser1"), ([], [], []))
+        records = self.db.get_all_records()
+        self.assertEqual([bill.user1_paid for bill in records], [1, 1, 1, 0])
+        self.assertEqual([bill.paid for bill in records], [1, 1, 1, 0])
+        self.assertEqual(records[0].note, "Test Note")
+
+        payments = self.db.get_payments(user="testuser1")
+        self.assertEqual(
+            [payment.bill_id for payment in payments], [1, 2, 3]
+        )
+        self.assertEqual(payments[0].user, "TestUser1")
+        self.assertEqual(payments[0].amount, records[0].owed_amount(1))
+        self.assertEqual(self.db.get_payments(user="testuser2"), [])
+        self.assertEqual(len(self.db.get_payments(bill_id=2)), 1)
+
+        before, after = self.db.rebuild_balances()
+        self.assertEqual(before, after)
+
+    def test_pay_bill_messages(self):
+        app = Application(self.db)
+        self.db.add_bill(
+            self.bill_generator(
+                utility="gas", user1_paid=False, user2_paid=False
+            )
+        )
+
+        def pay(*inputs):
+            output = io.StringIO()
+            with patch("builtins.input", side_effect=inputs), patch(
+                "sys.stdout", new=output
+            ):
+                with self.assertRaises(Navigation):
+                    app.pay_bill("gas")
+            return output.getvalue()
+
+        output = pay("testuser1", "1", "yes")
+        self.assertIn("You successfully paid your bill!", output)
+        self.assertNotIn("completely paid off", output)
+
+        # Paying again changes nothing and says so
+        self.db.add_bill(
+            self.bill_generator(
+                utility="gas", user1_paid=False, user2_paid=True
+            )
+        )
+        output = pay("testuser1", "1", "yes")
+        self.assertIn("already paid", output)
+        self.assertNotIn("completely paid off", output)
+        self.assertFalse(self.db.get_record(1).paid)
+
+        output = pay("testuser2", "1 2")
+        self.assertIn("paid 1 bills!", output)
+        self.assertIn("completely paid off: 1", output)
+        self.assertIn("1 bills had already been paid.", output)
+
+    def test_get_bills_between(self):
+        self.db.add_bill(self.bill_generator(amount=2000, date="12-20"))
+        self.db.add_bills(
+            [
+                self.bill_generator(
+                    amount=3000,
+                    date="01-21,02-21",
+                    user1_paid=True,
+                    user2_paid=True,
+                ),
+                self.bill_generator(amount=999, date="02-21", user1_paid=False),
+                self.bill_generator(amount=500, date="unknown"),
+            ]
+        )
+
+        self.assertEqual(
+            [bill.id for bill in self.db.get_bills_between("01-21", "03-21")],
+            [2, 3],
+        )
+        self.assertEqual(
+            [bill.id for bill in self.db.get_bills_between(202012, 202101)],
+            [1, 2],
+        )
+        self.assertEqual(
+            self.db.get_monthly_totals("01-21", "02-21"),
+            [(202101, 1500, 0), (202102, 2499, 999)],
+        )
+
+        self.db.remove_bill(2)
+        self.assertEqual(
+            [bill.id for bill in self.db.get_bills_between("01-21", "03-21")],
+            [3],
+        )
+
+    def test_bill_periods_follow_raw_writes(self):
+        dates = [
+            "03-21",
+            "13-21",
+            " 03-21 ,\t04-21,04-21",
+            "3-21,x,05-2",
+            '"06-21\\',
+            None,
+        ]
+        with self.db.transaction() as c:
+            c.executemany(
+                "INSERT INTO bills (utility, date) VALUES ('gas', ?)",
+                [(date,) for date in dates],
+            )
+            c.execute("SELECT id, date FROM bills ORDER BY id")
+            expected = {
+                (period, bill_id, 1 / len(set(parse_periods(date or ""))))
+                for bill_id, date in c.fetchall()
+                for period in parse_periods(date or "")
+            }
+            c.execute("SELECT period, bill_id, weight FROM bill_periods")
+            self.assertEqual(set(c.fetchall()), expected)
+
+            # Redating a bill moves it to its new months
+            c.execute("UPDATE bills SET date = '07-21,08-21' WHERE id = 1")
+        self.assertEqual(self.db.get_bills_between("03-21", "03-21")[0].id, 3)
+        self.assertEqual(
+            [bill.id for bill in self.db.get_bills_between("07-21", "08-21")],
+            [1],
+        )
+
+    def test_get_utility_page(self):
+        for _ in range(5):
+            self.db.add_bill(self.bill_generator(utility="gas"))
+            self.db.add_bill(
+                self.bill_generator(utility="rent", user2_paid=False)
+            )
+
+        first = self.db.get_utility_page("rent", limit=2)
+        second = self.db.get_utility_page(
+            "rent", after_id=first[-1].id, limit=2
+        )
+        previous = self.db.get_utility_page(
+            "rent", before_id=second[0].id, limit=2
+        )
+
+        self.assertEqual([bill.id for bill in first], [2, 4])
+        self.assertEqual([bill.id for bill in second], [6, 8])
+        self.assertEqual([bill.id for bill in previous], [2, 4])
+        self.assertEqual(
+            self.db.get_utility_page("rent", after_id=10, limit=2), []
+        )
+        self.assertEqual(
+            len(self.db.get_utility_page("rent", owed_by="testuser2")), 5
+        )
+
+    def test_iter_records(self):
+        self.db.add_bills(
+            self.bill_generator(utility="gas", user1_paid=False)
+            for _ in range(1200)
+        )
+
+        records = self.db.iter_utility_record("gas")
+        self.assertEqual(next(records).id, 1)
+        # Other queries must not disturb an iteration in progress
+        self.assertEqual(self.db.get_record(5).id, 5)
+        self.assertEqual(sum(1 for _ in records), 1199)
+
+        owed = self.db.iter_bills_owed("testuser1")
+        self.assertEqual(sum(1 for _ in owed), 1200)
+        self.assertEqual(
+            len(self.db.get_unpaid_bills()),
+            sum(1 for _ in self.db.iter_unpaid_bills()),
+        )
+
+    def test_concurrent_readers_and_writer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(
+                setup=True,
+                path=os.path.join(directory, "records.db"),
+                user1="Alice",
+                user2="Bob",
+            )
+            errors = []
+
+            def write():
+                try:
+                    for _ in range(50):
+                        db.add_bill(self.bill_generator(utility="gas"))
+                except Exception as error:
+                    errors.append(error)
+
+            def read():
+                try:
+                    for _ in range(50):
+                        records = db.get_utility_record("gas")
+                        ids = [bill.id for bill in records]
+                        self.assertEqual(ids, sorted(ids))
+                        db.get_balances()
+                except Exception as error:
+                    errors.append(error)
+
+            threads = [threading.Thread(target=write)] + [
+                threading.Thread(target=read) for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(errors, [])
+            self.assertEqual(len(db.get_utility_record("gas")), 50)
+            self.assertEqual(
+                db.conn.execute("PRAGMA journal_mode").fetchone(), ("wal",)
+            )
+            db.close()
+
+    def test_nested_transaction_rolls_back(self):
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction():
+                self.db.add_bill(self.bill_generator())
+                raise RuntimeError
+        self.assertEqual(self.db.get_all_records(), [])
+
+    def test_async_database_coalesces_writes(self):
+        async def scenario():
+            async_db = AsyncDatabase(Database(debug=True))
+            bills = [self.bill_generator(utility="gas") for _ in range(20)]
+
+            results = await asyncio.gather(
+                *(async_db.add_bill(bill) for bill in bills),
+                async_db.add_bill(None),
+                return_exceptions=True,
+            )
+            balances = await async_db.get_balances()
+            records = await async_db.get_utility_record("gas")
+            await async_db.close()
+            return async_db, results, balances, records
+
+        async_db, results, balances, records = asyncio.run(scenario())
+
+        self.assertIsInstance(results[-1], AttributeError)
+        self.assertEqual(results[:-1], [None] * 20)
+        self.assertEqual(async_db.writes, 21)
+        self.assertEqual(async_db.transactions, 1)
+        # Three gas bills come from the debugging fixture
+        self.assertEqual(len(records), 23)
+        self.assertIsInstance(balances, Balances)
+
+    def test_async_database_drops_failed_events(self):
+        db = Database(debug=True)
+        events = []
+        db.subscribe(lambda *event: events.append(event))
+
+        async def scenario():
+            async_db = AsyncDatabase(db)
+            ghost = self.bill_generator(utility="ghost")
+            rent = self.bill_generator(utility="rent")
+            results = await asyncio.gather(
+                async_db.add_bills([ghost, None], chunk_size=1),
+                async_db.add_bill(rent),
+                return_exceptions=True,
+            )
+            utilities = await async_db.get_utilities()
+            await async_db.close()
+            return results, utilities
+
+        results, utilities = asyncio.run(scenario())
+
+        self.assertIsInstance(results[0], AttributeError)
+        self.assertNotIn(("ghost",), utilities)
+        self.assertEqual(events, [("utility added", "rent")])
+
+    def test_server_reader_pool(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db = seeded_database(200, path=os.path.join(directory, "load.db"))
+            server = UtilitiesServer(db, port=0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            expected = len(db.get_utility_page("gas", limit=500))
+            statuses = []
+
+            def client():
+                conn = HTTPConnection("127.0.0.1", server.server_port)
+                for _ in range(20):
+                    conn.request("GET", "/utilities/gas/bills?limit=500")
+                    response = conn.getresponse()
+                    data = json.loads(response.read())
+                    statuses.append((response.status, len(data)))
+                conn.close()
+
+            try:
+                clients = [threading.Thread(target=client) for _ in range(4)]
+                for thread in clients:
+                    thread.start()
+                for thread in clients:
+                    thread.join()
+            finally:
+                server.shutdown()
+                server.server_close()
+                db.close()
+
+        self.assertEqual(statuses, [(200, expected)] * 80)
+
+    def test_server_etags(self):
+        server = UtilitiesServer(self.db, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        conn = HTTPConnection("127.0.0.1", server.server_port)
+
+        def request(method, path, body=None, headers={}):
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            return response, json.loads(data) if data else None
+
+        try:
+            response, data = request("GET", "/balances")
+            self.assertEqual(response.status, 200)
+            self.assertEqual(data["net"], 0)
+            etag = response.getheader("ETag")
+
+            response, data = request(
+                "GET", "/balances", headers={"If-None-Match": etag}
+            )
+            self.assertEqual(response.status, 304)
+            self.assertIsNone(data)
+
+            bill = {"utility": "gas", "date": "03-24", "amount": 4200}
+            response, _ = request("POST", "/bills", json.dumps(bill))
+            self.assertEqual(response.status, 201)
+
+            response, data = request(
+                "GET", "/balances", headers={"If-None-Match": etag}
+            )
+            self.assertEqual(response.status, 200)
+            self.assertEqual(data["net"], 0)
+            self.assertNotEqual(response.getheader("ETag"), etag)
+
+            response, data = request("GET", "/utilities/gas/bills")
+            self.assertEqual([bill["amount"] for bill in data], [4200])
+            bill_id = data[0]["id"]
+
+            response, data = request(
+                "POST",
+                "/payments",
+                json.dumps({"ids": [bill_id, 999], "user": "TestUser1"}),
+            )
+            self.assertEqual(
+                data, {"paid": [bill_id], "settled": [], "missing": [999]}
+            )
+
+            response, data = request(
+                "POST", "/payments", json.dumps({"ids": [1], "user": "nobody"})
+            )
+            self.assertEqual(response.status, 400)
+
+            response, data = request("GET", "/bills/oops")
+            self.assertEqual(response.status, 400)
+        finally:
+            conn.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_run_batch(self):
+        result = run_batch(
+            self.db,
+            [
+                "# monthly bills\n",
+                "add gas 03-24 4200\n",
+                'add "city water" 03-24,04-24 3000 meter read late\n',
+                "\n",
+                "add gas 04-24 3900\n",
+            ],
+        )
+        self.assertEqual(result.commands, {"add": 3})
+        gas = self.db.get_utility_record("gas")
+        water = self.db.get_utility_record("city water")
+        self.assertEqual([bill.amount for bill in gas], [4200, 3900])
+        self.assertEqual(water[0].note, "meter read late")
+
+        run_batch(
+            self.db,
+            [
+                f"pay {gas[0].id} {water[0].id} testuser1",
+                f"remove {gas[1].id}",
+            ],
+        )
+        self.assertTrue(self.db.get_record(gas[0].id).user1_paid)
+        self.assertIsNone(self.db.get_record(gas[1].id))
+
+        # A bad command rolls back the commands before it
+        with self.assertRaises(BatchError):
+            run_batch(self.db, ["remove-utility gas", "pay 999999 testuser2"])
+        self.assertEqual(len(self.db.get_utility_record("gas")), 1)
+
+    def test_benchmark_regressions(self):
+        results = run_suite([100], utilities=5)
+        timings = results["results"]["100"]
+        self.assertEqual(
+            set(timings),
+            {
+                "get_all_records",
+                "get_total_owed",
+                "get_net_balances",
+                "get_net_balances_cached",
+                "get_utility_record",
+                "add_bill",
+                "pay_bills",
+                "remove_utility",
+            },
+        )
+        self.assertEqual(find_regressions(results, results), [])
+
+        baseline = {"results": {"100": dict(timings, add_bill=0)}}
+        baseline["results"]["100"]["pay_bills"] = timings["pay_bills"] / 2
+        self.assertEqual(
+            find_regressions(
+                json.loads(json.dumps(results)), baseline, floor=0
+            ),
+            [("100", "pay_bills", 2.0)],
+        )
+
+        # Sub-millisecond timings are too noisy for a ratio alone
+        self.assertEqual(
+            find_regressions(results, baseline, floor=timings["pay_bills"]),
+            [],
+        )
+
+    def test_net_balances_and_settle(self):
+        bills = [
+            # a paid for everyone, so b and c owe a their thirds
+            (
+                900,
+                [
+                    Share("a", 1, True),
+                    Share("b", 1, False),
+                    Share("c", 1, False),
+                ],
+            ),
+            # d owes its fifth to b and c in proportion to their weights
+            (
+                1000,
+                [
+                    Share("b", 1, True),
+                    Share("c", 3, True),
+                    Share("d", 1, False),
+                ],
+            ),
+            # Nobody has paid, so nobody owes anybody
+            (5000, [Share("a", 1, False), Share("d", 1, False)]),
+        ]
+        balances = net_balances(bills)
+        self.assertEqual(balances, {"a": 600, "b": -250, "c": -150, "d": -200})
+
+        transfers = settle(balances)
+        self.assertEqual(len(transfers), 3)
+        self.assertEqual(transfers[0], Transfer("b", "a", 250))
+        settled = dict(balances)
+        for transfer in transfers:
+            settled[transfer.debtor] += transfer.amount
+            settled[transfer.creditor] -= transfer.amount
+        self.assertTrue(all(abs(amount) < 1e-9 for amount in settled.values()))
+
+    def test_settle_exactly(self):
+        balances = {"a": -4, "b": 8, "c": -4, "d": -5, "e": 5}
+        self.assertEqual(len(settle(balances)), 4)
+
+        transfers = settle_exactly(balances)
+        self.assertEqual(
+            sorted(transfers),
+            [
+                Transfer("a", "b", 4),
+                Transfer("c", "b", 4),
+                Transfer("d", "e", 5),
+            ],
+        )
+        self.assertEqual(plan_settlement(balances), transfers)
+        self.assertEqual(
+            plan_settlement(balances, exact=False), settle(balances)
+        )
+        self.assertEqual(settle_exactly({"a": 0.0}), [])
+
+    def test_bill_shares(self):
+        db = Database(debug=True)
+        with db.transaction() as c:
+            c.execute("DELETE FROM bills")
+        db.add_user("Carol")
+        db.add_bill(
+            self.bill_generator(
+                utility="rent", amount=9000, user1_paid=False, user2_paid=False
+            )
+        )
+        bill = db.get_utility_record("rent")[0]
+        self.assertEqual(
+            db.get_shares(bill.id),
+            [Share("TestUser1", 1, False), Share("TestUser2", 1, False)],
+        )
+
+        db.set_shares(bill.id, {"testuser1": 1, "testuser2": 1, "carol": 1})
+        self.assertTrue(db.pay_share(bill.id, "carol"))
+        self.assertFalse(db.pay_share(bill.id, "carol"))
+        self.assertEqual(
+            db.get_net_balances(),
+            {"TestUser1": -3000, "TestUser2": -3000, "Carol": 6000},
+        )
+
+        # Paying through the two-user columns updates the shares
+        db.pay_bills([bill.id], "testuser1")
+        db.pay_bills([bill.id], "testuser2")
+        shares = db.get_shares(bill.id)
+        self.assertTrue(all(share.paid for share in shares))
+        self.assertTrue(db.get_record(bill.id).paid)
+        self.assertEqual(db.get_settlement(), [])
+        payments = db.get_payments(bill_id=bill.id)
+        self.assertEqual([payment.amount for payment in payments], [3000] * 3)
+
+        with self.assertRaises(ValueError):
+            db.set_shares(bill.id, {"nobody": 1})
+        db.close()
+
+    def test_share_dropped_and_added_back(self):
+        db = Database(debug=True)
+        db.add_user("Carol")
+        db.add_bill(
+            self.bill_generator(
+                utility="rent", amount=3000, user1_paid=False, user2_paid=False
+            )
+        )
+        bill = db.get_utility_record("rent")[0]
+
+        # Leaving user 1 out gives them no share rather than a paid one
+        db.set_shares(bill.id, {"testuser2": 1, "carol": 1})
+        record = db.get_record(bill.id)
+        self.assertEqual(record.owed_amount(1), 0)
+        self.assertIn("TestUser1 has no share", str(record))
+        owed = lambda: [b.id for b in db.get_bills_owed("testuser1")]
+        self.assertNotIn(bill.id, owed())
+
+        db.set_shares(bill.id, {"testuser1": 1, "testuser2": 1, "carol": 1})
+        record = db.get_record(bill.id)
+        self.assertFalse(record.user1_paid)
+        self.assertEqual(record.owed_amount(1), 1000)
+        self.assertIn(bill.id, owed())
+        self.assertEqual(db.pay_bills([bill.id], "testuser1").paid, [bill.id])
+        self.assertEqual(
+            [payment.amount for payment in db.get_payments(bill_id=bill.id)],
+            [1000],
+        )
+        db.close()
+
+    def test_third_user_payments(self):
+        db = Database(debug=True)
+        db.add_user("Carol")
+        db.add_bill(
+            self.bill_generator(
+                utility="rent", amount=3000, user1_paid=False, user2_paid=False
+            )
+        )
+        bill = db.get_utility_record("rent")[0]
+
+        # Carol has no share yet, so paying leaves the bill untouched
+        self.assertEqual(db.pay_bills([bill.id], "carol"), ([], [], []))
+        self.assertFalse(db.get_record(bill.id).user2_paid)
+        self.assertEqual(db.get_payments(user="carol"), [])
+
+        db.set_shares(bill.id, {"testuser1": 1, "testuser2": 1, "carol": 1})
+        self.assertEqual(
+            [b.id for b in db.get_utility_page("rent", owed_by="carol")],
+            [bill.id],
+        )
+        db.pay_bills([bill.id], "carol")
+        record = db.get_record(bill.id)
+        self.assertFalse(record.user1_paid or record.user2_paid)
+        self.assertEqual(
+            [(p.user, p.amount) for p in db.get_payments(user="carol")],
+            [("Carol", 1000)],
+        )
+        self.assertEqual(db.get_payments(user="testuser2"), [])
+        self.assertEqual(db.get_utility_page("rent", owed_by="carol"), [])
+        self.assertEqual(list(db.iter_bills_owed("carol")), [])
+        self.assertEqual(len(db.get_bills_owed("testuser2")), 4)
+
+        for call in (
+            lambda: db.pay_bills([bill.id], "nobody"),
+            lambda: db.get_payments(user="nobody"),
+            lambda: db.get_bills_owed("nobody"),
+            lambda: db.get_total_owed("carol"),
+        ):
+            with self.assertRaises(ValueError):
+                call()
+        db.close()
+
+    def test_balances_follow_share_weights(self):
+        db = Database(debug=True)
+        with db.transaction() as c:
+            c.execute("DELETE FROM bills")
+        db.add_user("Carol")
+        db.add_bill(
+            self.bill_generator(
+                utility="rent", amount=3000, user1_paid=False, user2_paid=True
+            )
+        )
+        bill = db.get_utility_record("rent")[0]
+        db.set_shares(bill.id, {"testuser1": 1, "testuser2": 1, "carol": 1})
+
+        self.assertEqual(db.get_balances(), (1000, 0, 1000))
+        self.assertEqual(db.get_net_balances()["TestUser1"], -1000)
+        self.assertEqual(db.get_record(bill.id).owed_amount(1), 1000)
+        if numpy:
+            report = reports.build_report(db.get_bill_batch())
+            self.assertEqual((report.user1_owed, report.user2_owed), (1000, 0))
+
+        db.set_shares(bill.id, {"testuser1": 2, "testuser2": 1})
+        self.assertEqual(db.get_balances(), (2000, 0, 2000))
+        db.remove_bill(bill.id)
+        self.assertEqual(db.get_balances(), (0, 0, 0))
+        before, after = db.rebuild_balances()
+        self.assertEqual(before, after)
+        db.close()
+
+    def test_null_paid_flags(self):
+        db = Database(debug=True)
+        balances = db.get_balances()
+        with db.transaction() as c:
+            c.execute(
+                "INSERT INTO bills (utility, date, amount) "
+                "VALUES ('phone', '05-24', 1000)"
+            )
+            c.execute("UPDATE bills SET user1_paid = NULL WHERE id = 2")
+        phone = db.get_utility_record("phone")[0]
+
+        # Missing flags count as unpaid in every view of the bills
+        self.assertEqual(
+            (phone.user1_paid, phone.user2_paid, phone.paid),
+            (False, False, False),
+        )
+        self.assertFalse(db.get_record(2).user1_paid)
+        self.assertIn(phone.id, [bill.id for bill in db.get_unpaid_bills()])
+        self.assertEqual(db.get_balances().user1, balances.user1 + 2000)
+        self.assertEqual(db.get_balances().user2, balances.user2 + 500)
+        self.assertIn(("phone", 1, 1000), db.get_utility_stats())
+        self.assertEqual(db.get_shares(phone.id)[0].paid, False)
+
+        stats = db.get_utility_stats()
+        before, after = db.rebuild_balances()
+        self.assertEqual(before, after)
+        self.assertEqual(db.get_utility_stats(), stats)
+        db.close()
+
+        conn = sqlite3.connect(":memory:")
+        conn.execute(
+            """
+            CREATE TABLE bills (
+            id integer primary key, utility text, date text, amount integer,
+            user1_paid integer, user2_paid integer, paid integer, note text
+            )"""
+        )
+        conn.execute("CREATE TABLE users (id integer primary key, name text)")
+        conn.execute(
+            "INSERT INTO bills VALUES (1, 'gas', '05-21', 2000, 1, NULL, 1, '')"
+        )
+        conn.commit()
+        migrate(conn)
+        self.assertEqual(
+            conn.execute("SELECT user1_paid, user2_paid, paid FROM bills")
+            .fetchall(),
+            [(1, 0, 1)],
+        )
+        conn.close()
+
+    def test_query_cache(self):
+        db = Database(debug=True, cache_size=2)
+        balances = db.get_net_balances()
+        balances["TestUser1"] = 123
+        self.assertNotEqual(db.get_net_balances(), balances)
+        self.assertEqual((db.cache.hits, db.cache.misses), (1, 1))
+
+        # Cheap summary queries are not cached
+        db.get_utilities()
+        db.get_balances()
+        self.assertEqual((db.cache.hits, db.cache.misses), (1, 1))
+
+        db.add_bill(
+            self.bill_generator(
+                utility="rent", amount=3000, user1_paid=False, user2_paid=True
+            )
+        )
+        balances = db.get_net_balances()
+        self.assertEqual(db.cache.misses, 2)
+        self.assertEqual(len(db.cache), 1)
+
+        # Reads inside a transaction see its uncommitted changes
+        with db.transaction():
+            db.remove_utility("rent")
+            self.assertNotEqual(db.get_net_balances(), balances)
+        self.assertEqual(db.cache.misses, 2)
+        self.assertNotEqual(db.get_net_balances(), balances)
+        self.assertEqual(db.cache.misses, 3)
+
+        # Results read before a commit are not stored after it
+        generation = db.cache.generation
+        db.add_bill(self.bill_generator())
+        db.cache.put(("other",), generation, None)
+        self.assertEqual(len(db.cache), 0)
+        db.close()
+
+        # Commits from other connections invalidate the cache too
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "records.db")
+            db = Database(setup=True, path=path, user1="A", user2="B")
+            self.assertEqual(db.get_net_balances(), {"A": 0, "B": 0})
+            with sqlite3.connect(path) as conn:
+                conn.execute(
+                    """
+                    INSERT INTO bills (utility, amount, user1_paid, user2_paid)
+                    VALUES ('gas', 2000, 1, 0)
+                    """
+                )
+            conn.close()
+            self.assertEqual(db.get_net_balances(), {"A": 1000, "B": -1000})
+            self.assertEqual(db.cache.hits, 0)
+
+            # Tokens are shared by connections to the same file but never
+            # by different files
+            other = Database(path=path, user1="A", user2="B")
+            self.assertEqual(other.change_token(), db.change_token())
+            token = db.change_token()
+            other.add_utility("water")
+            self.assertNotEqual(db.change_token(), token)
+
+            copy_path = os.path.join(directory, "copy.db")
+            fresh = Database(setup=True, path=copy_path, user1="A", user2="B")
+            self.assertNotEqual(
+                fresh.change_token().split("-")[0], token.split("-")[0]
+            )
+            for database in (db, other, fresh):
+                database.close()
+
+    def test_menu_follows_utility_events(self):
+        db = Database(debug=True)
+        app = Application(db)
+        utilities = lambda: list(app.menus.main_options)[4:]
+        self.assertEqual(utilities(), ["electric", "gas", "travel", "water"])
+
+        events = []
+        db.subscribe(lambda *event: events.append(event))
+        db.add_bill(self.bill_generator(utility="rent"))
+        db.add_bill(self.bill_generator(utility="rent"))
+        self.assertEqual(events, [("utility added", "rent")])
+
+        # Swapping one utility for another keeps the same count
+        with db.transaction():
+            db.remove_utility("water")
+            db.add_bills([self.bill_generator(utility="internet")])
+        self.assertEqual(
+            utilities(), ["electric", "gas", "travel", "rent", "internet"]
+        )
+
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                db.remove_utility("gas")
+                raise RuntimeError
+        self.assertIn("gas", utilities())
+
+        # Utilities outlive their last bill and can be added without any
+        travel = db.get_utility_record("travel")[0]
+        db.remove_bill(travel)
+        db.remove_utility("nothing")
+        self.assertTrue(db.add_utility("phone"))
+        self.assertFalse(db.add_utility("phone"))
+        self.assertEqual(
+            utilities(),
+            ["electric", "gas", "travel", "rent", "internet", "phone"],
+        )
+        self.assertEqual(len(events), 4)
+        db.close()
+
+    def test_utilities_table(self):
+        db = Database(debug=True)
+        self.assertEqual(
+            db.get_utility_stats(),
+            [
+                ("electric", 1, 4500),
+                ("gas", 3, 2999),
+                ("travel", 1, 0),
+                ("water", 1, 6211),
+            ],
+        )
+
+        db.add_bills(
+            [
+                self.bill_generator(utility="rent", amount=5000),
+                self.bill_generator(utility="gas", amount=100),
+            ]
+        )
+        rent = db.get_utility_record("rent")[0]
+        db.pay_bills([rent.id], "testuser1")
+        db.pay_bills([rent.id], "testuser2")
+        gas = db.get_utility_record("gas")[0]
+        db.remove_bill(gas)
+        db.remove_utility("water")
+
+        stats = {row.name: row for row in db.get_utility_stats()}
+        self.assertEqual(stats["rent"], ("rent", 1, 0))
+        self.assertEqual(stats["gas"].bill_count, 3)
+        self.assertNotIn("water", stats)
+
+        # Bills written without a utility_id are linked by a trigger
+        with db.transaction() as c:
+            c.execute("INSERT INTO bills (utility, paid) VALUES ('gas', 0)")
+            c.execute(
+                """
+                SELECT COUNT(*) FROM bills
+                JOIN utilities ON utilities.id = bills.utility_id
+                WHERE utilities.name = 'gas'
+                """
+            )
+            self.assertEqual(c.fetchone()[0], 4)
+
+        db.rebuild_balances()
+        self.assertEqual(
+            {row.name: row for row in db.get_utility_stats()}["gas"],
+            ("gas", 4, stats["gas"].unpaid_total),
+        )
+        db.close()
+
     def test_get_utility_record(self):
 
         self.db.add_bill(self.bill_generator(utility="rent"))
@@ -156,6 +979,331 @@ class TestUtilityCalculator(unittest.TestCase):
         self.assertEqual(len(self.db.get_utility_record("gas")), 1)
         self.assertEqual(len(self.db.get_utility_record("electric")), 2)
 
+    def test_users_loaded_once(self):
+        for _ in range(5):
+            self.db.add_bill(self.bill_generator())
+
+        statements = []
+        self.db.conn.set_trace_callback(statements.append)
+        try:
+            records = self.db.get_all_records()
+        finally:
+            self.db.conn.set_trace_callback(None)
+
+        self.assertEqual(records[0].user1, "TestUser1")
+        self.assertEqual(records[0].user2, "TestUser2")
+        self.assertFalse([s for s in statements if "FROM users" in s])
+
+    def test_get_balances(self):
+        self.db.add_bill(
+            self.bill_generator(amount=2000, user1_paid=False, user2_paid=True)
+        )
+        self.db.add_bill(
+            self.bill_generator(amount=3000, user1_paid=False, user2_paid=False)
+        )
+        self.db.add_bill(
+            self.bill_generator(amount=999, user1_paid=True, user2_paid=False)
+        )
+
+        balances = self.db.get_balances()
+        self.assertEqual(balances.user1, 2500)
+        self.assertEqual(balances.user2, 1999.5)
+        self.assertEqual(balances.net, 500.5)
+        self.assertEqual(self.db.get_total_owed("testuser1"), 2500)
+        self.assertEqual(self.db.get_total_owed("testuser2"), 1999.5)
+
+    def test_balances_summary_tracks_writes(self):
+        bills = [self.bill_generator() for _ in range(10)]
+        for bill in bills:
+            self.db.add_bill(bill)
+
+        self.db.pay_bills([3], "testuser1")
+        self.db.pay_bills([3], "testuser2")
+        self.db.remove_bill(5)
+        self.db.remove_utility("gas")
+
+        before, after = self.db.rebuild_balances()
+        self.assertEqual(before, after)
+
+    def test_migrate_existing_database(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute(
+            """
+            CREATE TABLE bills (
+            id integer primary key, utility text, date text, amount integer,
+            user1_paid integer, user2_paid integer, paid integer, note text
+            )"""
+        )
+        conn.execute("CREATE TABLE users (id integer primary key, name text)")
+        conn.execute(
+            """
+            INSERT INTO bills VALUES
+            (NULL, "gas", "05-21", 2000, 1, 0, 0, "Test Note"),
+            (NULL, "water", "04-21", 3000, 0, 0, 0, "Test Note")
+            """
+        )
+        conn.commit()
+
+        self.assertEqual(migrate(conn), list(range(1, SCHEMA_VERSION + 1)))
+        self.assertEqual(migrate(conn), [])
+        self.assertEqual(get_version(conn), SCHEMA_VERSION)
+        self.assertEqual(
+            conn.execute("SELECT COUNT(*) FROM bills").fetchone()[0], 2
+        )
+        self.assertEqual(
+            conn.execute("SELECT * FROM balances").fetchone(), (1, 1500, 2500)
+        )
+        self.assertEqual(
+            conn.execute("SELECT * FROM bill_shares").fetchall(),
+            [(1, 1, 1.0, 1), (1, 2, 1.0, 0), (2, 1, 1.0, 0), (2, 2, 1.0, 0)],
+        )
+        plans = query_plans(conn)
+        for plan in plans.values():
+            self.assertNotIn("SCAN bills", plan)
+        self.assertIn(
+            "SEARCH bills USING INDEX bills_utility_id (utility_id=?)",
+            plans["get_utility_record"],
+        )
+        conn.close()
+
+    def test_migrate_payment_notes(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute(
+            """
+            CREATE TABLE bills (
+            id integer primary key, utility text, date text, amount integer,
+            user1_paid integer, user2_paid integer, paid integer, note text
+            )"""
+        )
+        conn.execute("CREATE TABLE users (id integer primary key, name text)")
+        conn.execute("INSERT INTO users VALUES (1, 'Alice'), (2, 'Bob')")
+        conn.execute(
+            "INSERT INTO bills VALUES (1, 'gas', '05-21', 2000, 1, 1, 1, ?)",
+            (
+                "Test Note"
+                "\nAlice paid 1000.0 for bill (ID 1) on May 03, 2021 "
+                "at 07:15 PM, paying off their portion of the bill."
+                "\nBob paid 1000.0 for bill (ID 1) on June 01, 2021 "
+                "at 09:00 AM, paying off their portion of the bill.",
+            ),
+        )
+        conn.commit()
+
+        migrate(conn)
+
+        self.assertEqual(
+            conn.execute("SELECT note FROM bills").fetchone(), ("Test Note",)
+        )
+        self.assertEqual(
+            conn.execute(
+                "SELECT bill_id, user_id, amount, paid_at FROM payments"
+            ).fetchall(),
+            [
+                (1, 1, 1000.0, "2021-05-03 19:15:00"),
+                (1, 2, 1000.0, "2021-06-01 09:00:00"),
+            ],
+        )
+        conn.close()
+
+    def test_db_add_bills(self):
+        bills = (self.bill_generator() for _ in range(25))
+        self.assertEqual(self.db.add_bills(bills, chunk_size=10), 25)
+        self.assertEqual(len(self.db.get_all_records()), 25)
+
+        before, after = self.db.rebuild_balances()
+        self.assertEqual(before, after)
+
+    def test_read_bills(self):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, "bills.csv")
+            with open(csv_path, "w") as file:
+                file.write(
+                    "utility,date,amount,user1_paid,user2_paid,paid,note\n"
+                    "gas,05-21,2000,1,0,0,Test Note\n"
+                    "water,04-21,3000,True,True,True,\n"
+                )
+
+            jsonl_path = os.path.join(directory, "bills.jsonl")
+            with open(jsonl_path, "w") as file:
+                file.write(
+                    '{"utility": "rent", "date": "03-21", "amount": 50000, '
+                    '"user1_paid": false, "user2_paid": true}\n'
+                )
+
+            csv_bills = list(read_bills(csv_path))
+            jsonl_bills = list(read_bills(jsonl_path))
+
+        self.assertEqual(len(csv_bills), 2)
+        self.assertEqual(csv_bills[0].amount, 2000)
+        self.assertTrue(csv_bills[0].user1_paid)
+        self.assertFalse(csv_bills[0].user2_paid)
+        self.assertTrue(csv_bills[1].paid)
+        self.assertEqual(jsonl_bills[0].utility, "rent")
+        self.assertTrue(jsonl_bills[0].user2_paid)
+
+    def test_export_round_trip(self):
+        for _ in range(7):
+            self.db.add_bill(self.bill_generator())
+        rows = list(self.db.iter_bill_rows(batch_size=3))
+
+        for extension in (".csv", ".jsonl"):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "bills" + extension)
+                self.assertEqual(
+                    write_bills(self.db.iter_bill_rows(batch_size=3), path), 7
+                )
+                imported = [
+                    self.db._bill_params(bill) for bill in read_bills(path)
+                ]
+
+            self.assertEqual(
+                [tuple(params.values()) for params in imported], rows
+            )
+
+    def test_backup_and_restore(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "records.db")
+            backup_dir = os.path.join(directory, "backup")
+            os.mkdir(backup_dir)
+
+            conn = sqlite3.connect(source)
+            conn.execute("CREATE TABLE bills (id integer primary key, note)")
+            conn.executemany(
+                "INSERT INTO bills VALUES (NULL, ?)",
+                [("x" * 500,) for _ in range(200)],
+            )
+            conn.commit()
+
+            full = backup.backup(source, backup_dir)
+            self.assertEqual(full.pages_written, full.pages_total)
+
+            conn.execute("UPDATE bills SET note = 'changed' WHERE id = 200")
+            conn.commit()
+            conn.close()
+
+            incremental = backup.backup(source, backup_dir, incremental=True)
+            self.assertLess(incremental.pages_written, incremental.pages_total)
+
+            restored = os.path.join(directory, "restored.db")
+            backup.restore(backup_dir, restored)
+            conn = sqlite3.connect(restored)
+            self.assertEqual(
+                conn.execute("SELECT note FROM bills WHERE id = 200").fetchone(),
+                ("changed",),
+            )
+            conn.close()
+
+            # An interrupted backup leaves the previous one usable
+            conn = sqlite3.connect(source)
+            conn.execute("UPDATE bills SET note = 'lost' WHERE id = 200")
+            conn.commit()
+            conn.close()
+            with patch("backup.os.replace", side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    backup.backup(source, backup_dir, incremental=True)
+            self.assertEqual(
+                sorted(os.listdir(backup_dir)),
+                ["records.db", "records.db.manifest.json"],
+            )
+            backup.restore(backup_dir, restored)
+
+            with open(full.path, "r+b") as file:
+                file.seek(-1, os.SEEK_END)
+                file.write(b"!")
+            with self.assertRaises(backup.BackupError):
+                backup.restore(backup_dir, restored)
+
+            # The database is never backed up onto itself
+            for destination in ("", directory):
+                with self.assertRaises(backup.BackupError):
+                    backup.backup(source, destination)
+            self.assertFalse(os.path.exists(source + backup.MANIFEST_SUFFIX))
+
+    def test_navigation_does_not_grow_stack(self):
+        app = Application(Database(debug=True))
+        inputs = ["main"] * (sys.getrecursionlimit() * 2) + ["quit"]
+
+        with patch("builtins.input", side_effect=inputs), patch(
+            "sys.stdout", new=io.StringIO()
+        ):
+            with self.assertRaises(SystemExit):
+                app.run()
+
+        self.assertEqual(app.transitions, len(inputs))
+
+    def test_redirect_raises_navigation(self):
+        with patch("sys.stdout", new=io.StringIO()):
+            with self.assertRaises(Navigation) as context:
+                redirect(None, destination="bill payment", utility="gas")
+        self.assertEqual(context.exception.destination, "bill payment")
+        self.assertEqual(context.exception.utility, "gas")
+
+        with patch("sys.stdout", new=io.StringIO()):
+            with self.assertRaises(Navigation) as context:
+                redirect(None, destination="bill payment")
+        self.assertEqual(context.exception.destination, "main menu")
+
+    def test_get_bill_batch(self):
+        for _ in range(20):
+            self.db.add_bill(self.bill_generator())
+
+        records = self.db.get_all_records()
+        batch = self.db.get_bill_batch(batch_size=6)
+
+        self.assertEqual(len(batch), 20)
+        self.assertLessEqual(len(batch.utilities), 4)
+        for record, bill in zip(records, batch):
+            self.assertEqual(
+                (record.id, record.utility, record.date, record.amount),
+                (bill.id, bill.utility, bill.date, bill.amount),
+            )
+            self.assertEqual(
+                (record.user1_paid, record.user2_paid, record.paid),
+                (bill.user1_paid, bill.user2_paid, bill.paid),
+            )
+        self.assertFalse(hasattr(records[0], "__dict__"))
+
+    @unittest.skipUnless(numpy, "reports require NumPy")
+    def test_build_report(self):
+        self.db.add_bill(
+            self.bill_generator(
+                utility="gas",
+                amount=2000,
+                date="03-17,04-17",
+                user1_paid=False,
+                user2_paid=True,
+            )
+        )
+        self.db.add_bill(
+            self.bill_generator(
+                utility="gas",
+                amount=3000,
+                date="04-17",
+                user1_paid=True,
+                user2_paid=True,
+            )
+        )
+        self.db.add_bill(
+            self.bill_generator(
+                utility="rent",
+                amount=999,
+                date="not a date",
+                user1_paid=True,
+                user2_paid=False,
+            )
+        )
+
+        report = reports.build_report(self.db.get_bill_batch())
+
+        self.assertEqual(report.utilities["gas"].total, 5000)
+        self.assertEqual(report.utilities["gas"].unpaid, 2000)
+        self.assertEqual(report.utilities["gas"].unpaid_ratio, 0.4)
+        self.assertEqual(report.utilities["rent"].bills, 1)
+        self.assertEqual(report.user1_owed, 1000)
+        self.assertEqual(report.user2_owed, 499.5)
+        self.assertEqual(report.months, {201703: 1000, 201704: 4000})
+        self.assertEqual(list(report.running_balance), [1000, 1000, 500.5])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,11 +1,13 @@
 import sys
 import os
+from time import perf_counter
 from typing import TYPE_CHECKING
 
 from bill import Bill
 from menus import Menu
-from database import Database
+from database import Database, Balances, PAGE_SIZE
 from helpers import (
+    Navigation,
     input_handler,
     redirect,
     formatted_today,
@@ -20,6 +22,7 @@ passing '--help' or '-h' flag to the command line.
 
 class Destinations:
     """Defines menu pages."""
+    MAIN_MENU = "main menu"
     UTILITY_MENU = "utility menu"
     BILL_ADDITION = "bill addition"
     BILL_PAYMENT = "bill payment"
@@ -41,6 +44,16 @@ class Application:
         self.user2 = self.user2_upper.lower()
         self.menus = Menu(self, db)
 
+        # Id after which the displayed page of each utility starts,
+        # and the first and last ids shown on that page
+        self.page_starts: dict[str, int] = {}
+        self.page_bounds: dict[str, tuple[int, int]] = {}
+
+        # Number of page transitions and the total time spent
+        # unwinding and dispatching them, shown in debugging mode.
+        self.transitions = 0
+        self.transition_time = 0.0
+
     def utilities(self) -> list:
         """Get a list of present utilities from the database."""
 
@@ -49,17 +62,24 @@ class Application:
             utilities.append(tupl[0])
         return utilities
 
-    def user_owes(self, user: int) -> float:
+    def user_owes(self, user: int, balances: Balances | None = None) -> float:
         """Get total owed by a given user."""
 
+        if balances is None:
+            balances = self.db.get_balances()
+
         if user == 1:
-            return self.db.get_total_owed(self.user1)
+            return balances.user1
         else:
-            return self.db.get_total_owed(self.user2)
+            return balances.user2
 
-    def final_owed(self) -> str:
+    def final_owed(self, balances: Balances | None = None) -> str:
         """Amount to pay and to who."""
-        amount = self.user_owes(1) - self.user_owes(2)
+
+        if balances is None:
+            balances = self.db.get_balances()
+
+        amount = balances.net
         if amount == 0:
             return "Neither user owes the other anything at this time."
 
@@ -82,29 +102,74 @@ class Application:
             f" and {self.user2_upper}'s utility calculator.\n"
             f"Today is {formatted_today()}"
         )
-        self.main_menu()
+        self.run()
+
+    def run(self) -> None:
+        """Dispatch page transitions until the program is closed.
+
+        Pages move to one another by raising Navigation, so every
+        transition returns here and the stack never grows.
+        A page which returns normally leads back to the main menu.
+        """
+
+        navigation = Navigation(Destinations.MAIN_MENU)
+        while True:
+            self.transitions += 1
+            self.transition_time += perf_counter() - navigation.requested
+            try:
+                self.dispatch(navigation)
+                navigation = Navigation(Destinations.MAIN_MENU)
+            except Navigation as next_navigation:
+                navigation = next_navigation
+
+    def dispatch(self, navigation: Navigation) -> None:
+        """Display the page a navigation points to."""
+
+        utility = navigation.utility
+        match navigation.destination:
+            case Destinations.UTILITY_MENU:
+                self.utility_menu(utility, display=navigation.display)
+            case Destinations.BILL_ADDITION:
+                self.add_bill(utility)
+            case Destinations.BILL_PAYMENT:
+                self.pay_bill(utility)
+            case Destinations.BILL_REMOVAL:
+                self.remove_bill(utility)
+            case _:
+                self.main_menu()
 
     def quit_program(self) -> None:
         """Close database connection and exit program."""
 
-        self.db.conn.close()
+        self.db.close()
         sys.exit("Closing program...")
 
     def main_menu(self) -> None:
         """Display main menu."""
 
-        self.menus.update_main_options()
+        self.page_starts.clear()
+        balances = self.db.get_balances()
         if self.db.debug is True:
             print(
                 "****************************\n" "------DEBUGGING MODE!------"
             )
+            if self.transitions:
+                overhead = self.transition_time / self.transitions * 1e6
+                print(
+                    f"{self.transitions} page transitions, "
+                    f"{overhead:.1f} microseconds average overhead"
+                )
+            print(
+                f"Query cache: {self.db.cache.hits} hits, "
+                f"{self.db.cache.misses} misses"
+            )
         print(
             "****************************\n"
             f"{self.user1_upper} currently owes "
-            f"{self.user_owes(1)} yen "
+            f"{self.user_owes(1, balances)} yen "
             f"and {self.user2_upper} currently owes "
-            f"{self.user_owes(2)} yen.\n"
-            f"{self.final_owed()}\n"
+            f"{self.user_owes(2, balances)} yen.\n"
+            f"{self.final_owed(balances)}\n"
             "You can examine a particular utility "
             f"or either {self.user1_upper} "
             f"or {self.user2_upper}'s payment history.\n"
@@ -146,9 +211,15 @@ class Application:
         )
 
         print("Here are their unpaid bills:")
-        for entry in self.db.get_bills_owed(user):
+        for entry in self.db.iter_bills_owed(user):
             print(entry)
-        self.main_menu()
+
+        print("Here are their payments:")
+        for payment in self.db.get_payments(user=user):
+            print(
+                f"{payment.paid_at}: paid {payment.amount} yen "
+                f"for bill (ID {payment.bill_id})"
+            )
 
     def utility_menu(self, utility: str, display=True) -> None:
         """Display utility menu options."""
@@ -182,6 +253,7 @@ class Application:
         intent = input_handler(
             self, prompt="What is the name of your new utility?"
         )
+        self.db.add_utility(intent)
         self.add_bill(intent)
 
     def remove_utility(self) -> None:
@@ -300,13 +372,11 @@ class Application:
             f"and added to the {bill.utility} bill record!\n"
             "Returning to main menu..."
         )
-        self.main_menu()
 
     def remove_bill(self, utility: str) -> None:
         """Remove a bill from the database."""
 
-        records = self.db.get_utility_record(utility)
-        if not records:
+        if not self.check_record(utility):
             redirect(
                 self,
                 message=f"There are no bills in {utility}.",
@@ -314,9 +384,6 @@ class Application:
                 utility=utility,
             )
 
-        for record in records:
-            print(record)
-
         intent = input_handler(
             self,
             prompt=("Which bill would you like to remove?\n" "Input bill ID:"),
@@ -325,22 +392,22 @@ class Application:
             utility=utility,
         )
 
-        for entry in records:
-            if entry.id == intent:
-                print(entry)
-                intent = input_handler(
-                    self,
-                    prompt=f"Will you remove this bill?",
-                    destination=Destinations.BILL_REMOVAL,
-                    boolean=True,
-                    utility=utility,
-                )
+        entry = self.db.get_record(intent)
+        if entry is not None and entry.utility == utility:
+            print(entry)
+            intent = input_handler(
+                self,
+                prompt=f"Will you remove this bill?",
+                destination=Destinations.BILL_REMOVAL,
+                boolean=True,
+                utility=utility,
+            )
 
-                if intent == "yes":
-                    self.db.remove_bill(entry)
-                    redirect(self, message=None)
-                else:
-                    redirect(self, message="Returning to main menu.")
+            if intent == "yes":
+                self.db.remove_bill(entry)
+                redirect(self, message=None)
+            else:
+                redirect(self, message="Returning to main menu.")
 
         redirect(
             self,
@@ -349,17 +416,63 @@ class Application:
             utility=utility,
         )
 
-    def check_record(self, utility: str) -> None:
-        """Print all bills under a given utility."""
+    def check_record(self, utility: str) -> list[Bill]:
+        """Print the current page of bills under a given utility."""
 
-        for record in self.db.get_utility_record(utility):
+        records = self.db.get_utility_page(
+            utility, after_id=self.page_starts.get(utility, 0)
+        )
+        if not records and self.page_starts.get(utility):
+            # The page emptied after bills were removed, so start over
+            self.page_starts.pop(utility)
+            records = self.db.get_utility_page(utility)
+
+        for record in records:
             print(record)
 
+        if records:
+            self.page_bounds[utility] = (records[0].id, records[-1].id)
+        else:
+            self.page_bounds.pop(utility, None)
+        return records
+
+    def next_page(self, utility: str) -> None:
+        """Move the utility menu to the next page of bills."""
+
+        first_id, last_id = self.page_bounds.get(utility, (0, 0))
+        if not self.db.get_utility_page(utility, after_id=last_id, limit=1):
+            redirect(
+                self,
+                message="There are no more bills.",
+                destination=Destinations.UTILITY_MENU,
+                utility=utility,
+                display=False,
+            )
+
+        self.page_starts[utility] = last_id
+        raise Navigation(Destinations.UTILITY_MENU, utility)
+
+    def previous_page(self, utility: str) -> None:
+        """Move the utility menu to the previous page of bills."""
+
+        first_id, last_id = self.page_bounds.get(utility, (0, 0))
+        records = self.db.get_utility_page(utility, before_id=first_id)
+        if not records:
+            redirect(
+                self,
+                message="This is the first page of bills.",
+                destination=Destinations.UTILITY_MENU,
+                utility=utility,
+                display=False,
+            )
+
+        self.page_starts[utility] = records[0].id - 1
+        raise Navigation(Destinations.UTILITY_MENU, utility)
+
     def check_unpaid_bills(self, utility: str) -> None:
         """Print all unpaid bills under a given utility."""
 
-        records = self.db.get_utility_record(utility)
-        if not records:
+        if not self.db.get_utility_page(utility, limit=1):
             redirect(
                 self,
                 message=f"There are no bills in {utility}.",
@@ -368,7 +481,7 @@ class Application:
             )
 
         checker = False
-        for entry in records:
+        for entry in self.db.iter_utility_record(utility):
             if not entry.paid:
                 checker = True
                 print(entry)
@@ -380,43 +493,12 @@ class Application:
                 utility=utility,
             )
 
-        self.utility_menu(utility, display=False)
+        raise Navigation(Destinations.UTILITY_MENU, utility, display=False)
 
     def pay_bill(self, utility: str) -> None:
         """Pay a bill."""
 
-        def payment(bill: Bill, user: str) -> None:
-            """Write information to bill object and send it to the database."""
-
-            if user == self.user1:
-                bill.user1_paid = True
-                bill.note += (
-                    f"\n{self.user1_upper} paid {bill.owed_amount} "
-                    f"for bill (ID {bill.id}) "
-                    f"on {formatted_today()}, "
-                    "paying off their portion of the bill."
-                )
-            else:
-                bill.user2_paid = True
-                bill.note += (
-                    f"\n{self.user2_upper} paid {bill.owed_amount} "
-                    f"for bill (ID {bill.id}) "
-                    f"on {formatted_today()}, "
-                    "paying off their portion of the bill."
-                )
-
-            if bill.user1_paid is True and bill.user2_paid is True:
-                bill.paid = True
-                self.db.pay_bill(bill)
-                print(f"Bill ID {bill.id} has been completely paid off!")
-
-            else:
-                self.db.pay_bill(bill)
-
-            print("You successfully paid your bill!")
-
-        records = self.db.get_utility_record(utility)
-        if not records:
+        if not self.db.get_utility_page(utility, limit=1):
             redirect(
                 self,
                 message=f"There are no bills in {utility}.",
@@ -435,31 +517,15 @@ class Application:
             utility=utility,
         )
 
-        if identity == self.user1:
-            collector = []
-            for entry in records:
-                if not entry.user1_paid:
-                    collector.append(entry)
-
-            if len(collector) == 0:
-                print("You don't have any bills to pay.")
-                redirect(self, message=None)
-
-            for entry in collector:
-                print(entry)
-
-        else:
-            collector = []
-            for entry in records:
-                if not entry.user2_paid:
-                    collector.append(entry)
-
-            if len(collector) == 0:
-                print("You don't have any bills to pay.")
-                redirect(self, message=None)
+        collector = self.db.get_utility_page(utility, owed_by=identity)
+        if len(collector) == 0:
+            print("You don't have any bills to pay.")
+            redirect(self, message=None)
 
-            for entry in collector:
-                print(entry)
+        for entry in collector:
+            print(entry)
+        if len(collector) == PAGE_SIZE:
+            print(f"Showing your first {PAGE_SIZE} unpaid bills.")
 
         intent = input_handler(
             self,
@@ -477,29 +543,41 @@ class Application:
 
         # Paying by a single ID
         if len(intent_list) == 1:
-            for entry in records:
-                if entry.id == int(intent):
-                    intent = input_handler(
-                        self,
-                        prompt=(
-                            f"{entry}\nYou owe {entry.owed_amount} yen\n"
-                            "Will you pay your bill?"
-                        ),
-                        destination=Destinations.BILL_PAYMENT,
-                        utility=utility,
-                        boolean=True,
-                    )
-
-                    match intent:
-                        case "yes":
-                            payment(entry, identity)
-                            redirect(self, message=None)
-                        case "no":
-                            redirect(self, message=None)
-                        case _:
-                            redirect(
-                                self, destination=Destinations.BILL_PAYMENT, utility=utility
+            entry = self.db.get_record(int(intent))
+            if entry is not None and entry.utility == utility:
+                owed = entry.owed_amount(1 if identity == self.user1 else 2)
+                intent = input_handler(
+                    self,
+                    prompt=(
+                        f"{entry}\nYou owe {owed} yen\n"
+                        "Will you pay your bill?"
+                    ),
+                    destination=Destinations.BILL_PAYMENT,
+                    utility=utility,
+                    boolean=True,
+                )
+
+                match intent:
+                    case "yes":
+                        result = self.db.pay_bills([entry.id], identity)
+                        if result.paid:
+                            print("You successfully paid your bill!")
+                        else:
+                            print("You have already paid this bill.")
+                        if result.settled:
+                            print(
+                                f"Bill ID {entry.id} "
+                                "has been completely paid off!"
                             )
+                        redirect(self, message=None)
+                    case "no":
+                        redirect(self, message=None)
+                    case _:
+                        redirect(
+                            self,
+                            destination=Destinations.BILL_PAYMENT,
+                            utility=utility,
+                        )
 
             redirect(
                 self,
@@ -510,11 +588,23 @@ class Application:
 
         # Paying by multiple IDs
         elif len(intent_list) > 1:
-            for id_intent in intent_list:
-                for entry in records:
-                    if int(id_intent) == entry.id:
-                        payment(entry, identity)
-
+            ids = [int(id_intent) for id_intent in intent_list if id_intent]
+            result = self.db.pay_bills(ids, identity, utility=utility)
+
+            print(f"You successfully paid {len(result.paid)} bills!")
+            if result.settled:
+                print(
+                    "The following bills have been completely paid off: "
+                    f"{', '.join(str(bill_id) for bill_id in result.settled)}"
+                )
+            already_paid = set(ids) - set(result.paid) - set(result.missing)
+            if already_paid:
+                print(f"{len(already_paid)} bills had already been paid.")
+            if result.missing:
+                print(
+                    "The following bill IDs could not be found: "
+                    f"{', '.join(str(bill_id) for bill_id in result.missing)}"
+                )
             redirect(self, message=None)
 
         else: